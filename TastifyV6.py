@@ -8,36 +8,71 @@ Fitur:
 - Cover art dibaca dari file (tidak pernah di-embed)
 - Cover 1:1 di tengah, list MP3 kotak kecil di bawah cover
 - Input/Output folder jelas di-label
+- Startup cepat: modul berat & audio device di-load lazily, sesi terakhir di-restore
+- Genre rules: tagging massal berbasis rule (dry-run diff, commit ke pending)
+- Smart playlists (extended M3U), hanya ditulis ulang kalau isinya berubah
+- Deteksi duplikat berdasarkan hash audio (tanpa tag), skip/hardlink saat export
+- Analisis loudness paralel (NumPy), normalisasi ReplayGain saat playback
+- Saran genre offline dari fitur audio (nearest centroid terhadap track yang sudah di-tag)
+- Multi-root library, I/O dijadwalkan per device (satu lane + limit per disk/mount)
+- Klik heading untuk sort, group-by genre/artist/album/pending (presorted, cepat di 100k file)
 
 Dependencies:
     pip install mutagen pillow
     pip install pygame-ce   # atau pygame biasa kalau kompatibel
+    pip install numpy       # opsional, untuk analisis loudness & saran genre
 """
 
 import os
 import io
-import glob
+import re
+import math
+import hashlib
+import json
+import queue
+import fnmatch
+import argparse
 import shutil
+import threading
+import multiprocessing
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import traceback
 import time
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox, simpledialog
 from datetime import timedelta
 
-from mutagen.id3 import ID3, ID3NoHeaderError, APIC, TCON
-from mutagen.mp3 import MP3
-from PIL import Image, ImageTk
+# mutagen, PIL dan pygame sengaja tidak di-import di sini: import-nya lambat,
+# jadi di-load saat pertama dipakai (atau di background setelah window tampil).
+
+SESSION_PATH = os.path.join(os.path.expanduser("~"), ".tastetify_session.json")
+# tag cache (files, library, exported): besar, jadi file sendiri, ditulis di background
+LIBRARY_PATH = os.path.join(os.path.expanduser("~"), ".tastetify_library.json")
+LIBRARY_SAVE_DELAY_MS = 2000  # coalesce cache writes that come in bursts
+
+# pygame module, diisi oleh load_pygame()
+pygame = None
+_pygame_tried = False
+_pygame_lock = threading.Lock()
+
+
+def load_pygame():
+    """Import pygame on first use. Returns the module, or None if unavailable."""
+    global pygame, _pygame_tried
+    with _pygame_lock:
+        if not _pygame_tried:
+            _pygame_tried = True
+            try:
+                import pygame as _pygame
+                pygame = _pygame
+            except Exception:
+                pygame = None
+    return pygame
 
-# try to import pygame for playback
-try:
-    import pygame
-    PYGAME_AVAILABLE = True
-except Exception:
-    pygame = None
-    PYGAME_AVAILABLE = False
 
 # ---------------- ID3 helpers ----------------
 def read_genre(path):
+    from mutagen.id3 import ID3, ID3NoHeaderError
     try:
         id3 = ID3(path)
     except ID3NoHeaderError:
@@ -51,6 +86,7 @@ def read_genre(path):
 
 
 def write_genre(path, genre):
+    from mutagen.id3 import ID3, ID3NoHeaderError, TCON
     try:
         try:
             id3 = ID3(path)
@@ -69,6 +105,8 @@ def read_basic_tags(path):
     """
     Return simple dict for display: title, artist, album, duration.
     """
+    from mutagen.id3 import ID3, ID3NoHeaderError
+    from mutagen.mp3 import MP3
     info = {"title": "", "artist": "", "album": "", "duration": None}
     try:
         id3 = ID3(path)
@@ -94,6 +132,8 @@ def read_basic_tags(path):
 
 
 def read_cover_image(path):
+    from mutagen.id3 import ID3, ID3NoHeaderError
+    from PIL import Image
     try:
         id3 = ID3(path)
     except ID3NoHeaderError:
@@ -112,6 +152,7 @@ def read_cover_image(path):
 
 
 def get_duration_seconds(path):
+    from mutagen.mp3 import MP3
     try:
         audio = MP3(path)
         return float(audio.info.length)
@@ -119,6 +160,1088 @@ def get_duration_seconds(path):
         return None
 
 
+def read_library_entry(path, st=None):
+    """
+    Return the cached metadata for one file: basic tags, genre, and the
+    size/mtime used to tell whether the cache is still valid.
+    """
+    if st is None:
+        st = os.stat(path)
+    entry = read_basic_tags(path)
+    entry["genre"] = read_genre(path) or ""
+    entry["size"] = st.st_size
+    entry["mtime"] = st.st_mtime
+    return entry
+
+
+def entry_is_fresh(entry, st):
+    return bool(entry) and entry.get("size") == st.st_size and entry.get("mtime") == st.st_mtime
+
+
+# ---------------- Library roots & I/O scheduling ----------------
+DEFAULT_LANE_LIMIT = 2  # concurrent I/O jobs per device
+
+
+def walk_mp3(root):
+    """
+    Yield (path, stat) for every .mp3 (any case) under root. Uses scandir
+    directly: entry types come from the dirent, files other than MP3s are
+    never stat'ed, and each directory costs one stat for the loop guard.
+    Symlinked folders are followed (like the old recursive glob); a folder
+    reached twice, e.g. through a link back to a parent, is walked once.
+    """
+    try:
+        st = os.stat(root)
+    except OSError as e:
+        print("scan error:", root, e)
+        return
+    visited = {(st.st_dev, st.st_ino)}
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        try:
+            it = os.scandir(folder)
+        except OSError as e:
+            print("scan error:", folder, e)
+            continue
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        st = entry.stat()
+                        if (st.st_dev, st.st_ino) not in visited:
+                            visited.add((st.st_dev, st.st_ino))
+                            stack.append(entry.path)
+                    elif entry.name.lower().endswith(".mp3") and entry.is_file():
+                        yield entry.path, entry.stat()
+                except OSError:
+                    continue
+
+
+class IOScheduler:
+    """
+    Spread I/O over library roots: each device (st_dev) gets its own lane,
+    a thread pool with its own concurrency limit, so a slow disk or network
+    mount only holds up the work queued on that device.
+    """
+
+    def __init__(self, roots, limits=None, default_limit=DEFAULT_LANE_LIMIT):
+        limits = limits or {}
+        self.roots = sorted((os.path.abspath(r) for r in roots), key=len, reverse=True)
+        self._root_lane = {}
+        self._lane_limit = {}
+        for root in self.roots:
+            try:
+                lane = os.stat(root).st_dev
+            except OSError:
+                lane = root  # unreachable root: keep it in a lane of its own
+            self._root_lane[root] = lane
+            if limits.get(root):
+                limit = int(limits[root])
+                self._lane_limit[lane] = min(limit, self._lane_limit.get(lane, limit))
+        self._default_limit = default_limit
+        self._lanes = {}
+        self._lock = threading.Lock()
+        self.cancelled = threading.Event()  # set by shutdown(cancel=True); pool_map stops on it
+
+    def root_for(self, path):
+        for root in self.roots:
+            if path == root or path.startswith(root + os.sep):
+                return root
+        return None
+
+    def lane_for(self, path):
+        return self._root_lane.get(self.root_for(path))
+
+    def _executor(self, lane):
+        with self._lock:
+            ex = self._lanes.get(lane)
+            if ex is None:
+                limit = self._lane_limit.get(lane, self._default_limit)
+                ex = self._lanes[lane] = ThreadPoolExecutor(max_workers=max(1, limit))
+            return ex
+
+    def submit(self, fn, item, key=None):
+        """Run fn(item) in the lane of key(item) (default: the item itself as a path)."""
+        if self.cancelled.is_set():
+            fut = Future()
+            fut.cancel()
+            return fut
+        return self._executor(self.lane_for(key(item) if key else item)).submit(fn, item)
+
+    def map(self, fn, items, key=None):
+        """Like submit() for every item. Yields (item, result, error) in completion order."""
+        futures = {self.submit(fn, it, key): it for it in items}
+        for fut in as_completed(futures):
+            it = futures[fut]
+            try:
+                yield it, fut.result(), None
+            except Exception as e:
+                yield it, None, e
+
+    def lane_label(self, root):
+        lane = self._root_lane.get(os.path.abspath(root))
+        return f"dev {lane}" if isinstance(lane, int) else "unreachable"
+
+    def limit_for(self, root):
+        return self._lane_limit.get(self._root_lane.get(os.path.abspath(root)), self._default_limit)
+
+    def shutdown(self, cancel=False):
+        # queued work still finishes unless cancel; a running job may hold this scheduler
+        if cancel:
+            self.cancelled.set()
+        with self._lock:
+            lanes, self._lanes = self._lanes, {}
+        for ex in lanes.values():
+            ex.shutdown(wait=False, cancel_futures=cancel)
+
+
+def scan_library(roots, cached=None, scheduler=None, report=None):
+    """
+    Find all MP3s under the roots. Returns (files, library); tags are only
+    re-read for files whose size/mtime differ from the cached entry. Roots
+    are walked, and stale tags read, in their device lanes; report(msg)
+    gets progress as each root finishes.
+    """
+    if isinstance(roots, str):
+        roots = [roots]
+    roots = [os.path.abspath(r) for r in roots]
+    cached = cached or {}
+    own = scheduler is None
+    if own:
+        scheduler = IOScheduler(roots)
+    try:
+        found = {}
+        walks = scheduler.map(lambda r: list(walk_mp3(r)), roots)
+        for i, (root, entries, err) in enumerate(walks, 1):
+            if err:
+                print("scan error:", root, err)
+            else:
+                found.update(entries)
+            if report:
+                report(f"Scanned {i}/{len(roots)} root(s), {len(found)} MP3 file(s) so far...")
+        library = read_entries(found, cached, scheduler, report)
+    finally:
+        if own:
+            scheduler.shutdown()
+    return sorted(library), library
+
+
+def read_entries(found, cached, scheduler, report=None):
+    """path -> entry for found (path -> stat); only entries stale in `cached` are re-read, in the lanes."""
+    library = {}
+    stale = []
+    for path, st in found.items():
+        entry = cached.get(path)
+        if entry_is_fresh(entry, st):
+            library[path] = entry
+        else:
+            stale.append(path)
+    reads = scheduler.map(lambda p: read_library_entry(p, found[p]), stale)
+    for i, (path, entry, err) in enumerate(reads, 1):
+        library[path] = entry if not err else {"genre": ""}
+        if report and i % 200 == 0:
+            report(f"Reading tags {i}/{len(stale)}...")
+    return library
+
+
+def index_output(base, cached, scheduler, report=None):
+    """
+    Exported MP3s in the genre folders of the output folder base (path ->
+    entry). Listing them is cheap (scandir, one level deep); tags are only
+    read for files that changed since their `cached` entry.
+    """
+    found = {}
+    try:
+        for gdir in os.scandir(base):
+            if not gdir.is_dir():
+                continue
+            for f in os.scandir(gdir.path):
+                if f.is_file() and f.name.lower().endswith(".mp3"):
+                    found[os.path.abspath(f.path)] = f.stat()
+    except OSError as e:
+        print("Output index error:", e)
+    return read_entries(found, cached, scheduler, report)
+
+
+def read_file(path):
+    with open(path, "rb") as fh:
+        return fh.read()
+
+
+def pool_map(fn, items, *args, scheduler=None, key=None, load=read_file):
+    """
+    Yield (item, result, error) for fn(item, payload, *args) on the process
+    pool, in completion order.
+
+    Without a scheduler the workers read the files themselves (payload is
+    None). With one, only the read, load(item), runs in the item's device
+    lane; the CPU work is handed to the pool without waiting for it, so
+    every core stays busy while each device has at most its lane limit of
+    reads in flight. The number of loaded payloads waiting for a worker is
+    bounded to keep memory in check. With load=None the workers read for
+    themselves (payload None); the lanes then only queue the jobs. Once the scheduler is cancelled, no
+    more files are read, queued pool jobs are dropped and the generator
+    stops after the jobs already running.
+    """
+    items = list(items)
+    with process_pool() as pool:
+        if scheduler is None:
+            futures = {pool.submit(fn, it, None, *args): it for it in items}
+            for fut in as_completed(futures):
+                it = futures[fut]
+                try:
+                    yield it, fut.result(), None
+                except Exception as e:
+                    yield it, None, e
+            return
+
+        finished = queue.Queue()
+        slots = threading.BoundedSemaphore(2 * POOL_WORKERS)
+        cancelled = scheduler.cancelled
+
+        def stage(it):
+            slots.acquire()
+            try:
+                if cancelled.is_set():
+                    raise CancelledError()
+                fut = pool.submit(fn, it, load(it) if load else None, *args)
+            except Exception as e:
+                slots.release()
+                finished.put((it, None, e))
+                return
+
+            def on_done(f):
+                slots.release()
+                finished.put((it, f, None))
+
+            fut.add_done_callback(on_done)
+
+        for it in items:
+            scheduler.submit(stage, it, key)
+        remaining = len(items)
+        while remaining:
+            if cancelled.is_set():
+                # drop the queued pool jobs; items dropped from the lanes never report
+                pool.shutdown(wait=False, cancel_futures=True)
+                return
+            try:
+                it, fut, err = finished.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            remaining -= 1
+            if err is None:
+                try:
+                    yield it, fut.result(), None
+                    continue
+                except Exception as e:
+                    err = e
+            yield it, None, err
+
+
+# ---------------- Genre rules ----------------
+# Rule: {"field": one of RULE_FIELDS, "pattern": glob (case-insensitive), "genre": str}
+# Rules are ordered; the first matching rule decides the genre of a file.
+RULE_FIELDS = ("path", "folder", "artist", "album", "genre")
+
+
+def compile_genre_rules(rules):
+    compiled = []
+    for rule in rules:
+        field = rule.get("field")
+        if field not in RULE_FIELDS:
+            raise ValueError(f"Unknown rule field: {field!r}")
+        regex = re.compile(fnmatch.translate(rule.get("pattern") or ""), re.IGNORECASE)
+        compiled.append((field, regex, str(rule.get("genre") or "")))
+    return compiled
+
+
+def _rule_subject(field, path, entry, roots):
+    if field == "path":
+        root = next((r for r in roots if path.startswith(r + os.sep)), None)
+        rel = os.path.relpath(path, root) if root else path
+        return rel.replace(os.sep, "/")
+    if field == "folder":
+        return os.path.basename(os.path.dirname(path))
+    return entry.get(field) or ""
+
+
+def evaluate_genre_rules(rules, files, library, pending=None, roots=()):
+    """
+    Evaluate rules in one pass over the cached library metadata.
+    Returns a list of (path, old_genre, new_genre) for files whose genre
+    would change. `old_genre` is the pending genre if there is one.
+    Path globs are matched relative to the library root of each file.
+    """
+    compiled = compile_genre_rules(rules)
+    pending = pending or {}
+    if isinstance(roots, str):
+        roots = [roots]
+    roots = sorted((os.path.abspath(r) for r in roots), key=len, reverse=True)
+    diff = []
+    for path in files:
+        entry = library.get(path) or {}
+        for field, regex, genre in compiled:
+            if regex.match(_rule_subject(field, path, entry, roots)):
+                old = pending[path] if path in pending else entry.get("genre") or ""
+                if genre != old:
+                    diff.append((path, old, genre))
+                break
+    return diff
+
+
+def load_rules_file(path):
+    with open(path, "r", encoding="utf-8") as fh:
+        data = json.load(fh)
+    rules = data.get("rules", []) if isinstance(data, dict) else data
+    compile_genre_rules(rules)  # validate
+    return rules
+
+
+def save_rules_file(path, rules):
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump({"version": 1, "rules": rules}, fh, indent=2)
+
+
+# ---------------- Duplicates ----------------
+def audio_span(fh, size):
+    """
+    Return (start, end) of the audio frames in an MP3, skipping ID3v2 at the
+    start and APEv2 / Lyrics3v2 / ID3v1 at the end, so retagging a copy
+    does not change its fingerprint.
+    """
+    start, end = 0, size
+    fh.seek(0)
+    head = fh.read(10)
+    while len(head) == 10 and head[:3] == b"ID3":
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        start += 10 + tag_size + (10 if head[5] & 0x10 else 0)
+        fh.seek(start)
+        head = fh.read(10)
+
+    changed = True
+    while changed and end > start:
+        changed = False
+        if end - start >= 128:
+            fh.seek(end - 128)
+            if fh.read(3) == b"TAG":
+                end -= 128
+                changed = True
+                continue
+        if end - start >= 32:
+            fh.seek(end - 32)
+            footer = fh.read(32)
+            if footer[:8] == b"APETAGEX":
+                tag_size = int.from_bytes(footer[12:16], "little")
+                flags = int.from_bytes(footer[20:24], "little")
+                end -= tag_size + (32 if flags & 0x80000000 else 0)
+                changed = True
+                continue
+        if end - start >= 15:
+            fh.seek(end - 15)
+            trailer = fh.read(15)
+            if trailer[6:] == b"LYRICS200" and trailer[:6].isdigit():
+                end -= int(trailer[:6]) + 15
+                changed = True
+    return start, max(start, end)
+
+
+def audio_fingerprint(path, data=None, chunk_size=1 << 20):
+    """
+    Hash of the audio frames only (runs in the worker processes). `data`
+    is the file content when it was already read in the device lane.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with (io.BytesIO(data) if data is not None else open(path, "rb")) as fh:
+        start, end = audio_span(fh, fh.seek(0, os.SEEK_END))
+        fh.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            chunk = fh.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h.hexdigest()
+
+
+POOL_WORKERS = os.cpu_count() or 1
+
+
+def process_pool():
+    # spawn, bukan fork: proses utama punya Tk dan thread lain. Import modul
+    # ini murah (modul berat di-load lazily), jadi worker start cepat.
+    return ProcessPoolExecutor(POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+
+def hash_files(paths, report=None, scheduler=None):
+    """Fingerprint paths on a process pool. Returns path -> hash."""
+    results = {}
+    if not paths:
+        return results
+    for i, (path, digest, err) in enumerate(pool_map(audio_fingerprint, paths, scheduler=scheduler), 1):
+        if err:
+            print("hash error:", path, err)
+        else:
+            results[path] = digest
+        if report and i % 100 == 0:
+            report(f"Hashing audio {i}/{len(paths)}...")
+    return results
+
+
+def group_duplicates(files, library):
+    """Groups (lists of paths, in files order) that share the same audio hash."""
+    by_hash = {}
+    for p in files:
+        digest = (library.get(p) or {}).get("audio_hash")
+        if digest:
+            by_hash.setdefault(digest, []).append(p)
+    return [paths for paths in by_hash.values() if len(paths) > 1]
+
+
+def unique_dest(dest, taken=(), reuse=None):
+    """
+    dest, or the first "name (n).ext" after it, that is not taken and does
+    not exist. An existing name is also returned when reuse(name, stat)
+    says it already holds the file (an earlier export of it).
+    """
+    root, ext = os.path.splitext(dest)
+    n = 1
+    while True:
+        if dest not in taken:
+            try:
+                st = os.stat(dest)
+            except FileNotFoundError:
+                return dest
+            except OSError:
+                st = None
+            if st and reuse and reuse(dest, st):
+                return dest
+        dest = f"{root} ({n}){ext}"
+        n += 1
+
+
+# ---------------- Loudness / ReplayGain ----------------
+REPLAYGAIN_REFERENCE = -18.0  # LUFS, ReplayGain 2.0
+# the mixer volume cannot go above 1.0: every track is played this much
+# lower so positive gains (quiet tracks) still fit
+PLAYBACK_HEADROOM_DB = 8.0
+
+
+def decode_pcm(path, data=None):
+    """
+    Decode an MP3 (from `data` if the bytes were already read, else from
+    path) to float32 samples (frames, channels) in [-1, 1] with pygame.
+    Meant for worker processes: it opens a dummy audio device.
+    """
+    import numpy as np
+
+    os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+    pg = load_pygame()
+    if pg is None:
+        raise RuntimeError("pygame is required to decode audio")
+    if not pg.mixer.get_init():
+        os.environ["SDL_AUDIODRIVER"] = "dummy"
+        pg.mixer.init(frequency=44100, size=-16, channels=2)
+    rate, fmt, _channels = pg.mixer.get_init()
+    samples = pg.sndarray.array(pg.mixer.Sound(file=io.BytesIO(data) if data is not None else path))
+    if samples.ndim == 1:
+        samples = samples[:, None]
+    scale = float(1 << (abs(fmt) - 1))
+    return samples.astype(np.float32) / scale, rate
+
+
+def _biquad_power(b, a, w):
+    import numpy as np
+
+    z = np.exp(-1j * w)
+    num = b[0] + b[1] * z + b[2] * z * z
+    den = a[0] + a[1] * z + a[2] * z * z
+    return np.abs(num / den) ** 2
+
+
+def k_weighting_power(freqs, rate):
+    """|H(f)|^2 of the BS.1770 K-weighting filter (shelf + high-pass) at any rate."""
+    import numpy as np
+
+    w = 2 * np.pi * freqs / rate
+    # high shelf, +4 dB above ~1.7 kHz (same derivation as libebur128)
+    K = np.tan(np.pi * 1681.974450955533 / rate)
+    Q = 0.7071752369554196
+    Vh = 10 ** (3.999843853973347 / 20)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1 + K / Q + K * K
+    shelf_b = ((Vh + Vb * K / Q + K * K) / a0, 2 * (K * K - Vh) / a0, (Vh - Vb * K / Q + K * K) / a0)
+    shelf_a = (1.0, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0)
+    # high-pass ~38 Hz
+    K = np.tan(np.pi * 38.13547087602444 / rate)
+    Q = 0.5003270373238773
+    a0 = 1 + K / Q + K * K
+    hp_b = (1.0, -2.0, 1.0)
+    hp_a = (1.0, 2 * (K * K - 1) / a0, (1 - K / Q + K * K) / a0)
+    return _biquad_power(shelf_b, shelf_a, w) * _biquad_power(hp_b, hp_a, w)
+
+
+def integrated_loudness(samples, rate):
+    """
+    Gated integrated loudness (LUFS) and sample peak, following BS.1770.
+    The K-weighting is applied in the frequency domain on 100 ms segments;
+    the 400 ms / 75 % overlap gating blocks are sums of 4 segments.
+    """
+    import numpy as np
+
+    seg = int(rate * 0.1)
+    n_seg = samples.shape[0] // seg
+    peak = float(np.max(np.abs(samples))) if samples.size else 0.0
+    if n_seg < 4:
+        return None, peak
+    weights = k_weighting_power(np.fft.rfftfreq(seg, 1.0 / rate), rate)
+    weights[1:(seg + 1) // 2] *= 2  # one-sided spectrum (Parseval)
+    weights /= seg * seg
+
+    energy = np.zeros(n_seg)
+    step = 600  # segments per FFT batch (60 s), keeps memory bounded
+    for i in range(0, n_seg, step):
+        j = min(n_seg, i + step)
+        block = samples[i * seg:j * seg].reshape(j - i, seg, -1)
+        spec = np.fft.rfft(block, axis=1)
+        energy[i:j] = np.einsum("sfc,f->s", np.abs(spec) ** 2, weights)
+
+    z = np.convolve(energy, np.ones(4) / 4, mode="valid")
+    with np.errstate(divide="ignore"):
+        block_lufs = -0.691 + 10 * np.log10(z)
+    gated = z[block_lufs > -70.0]
+    if not gated.size:
+        return None, peak
+    rel = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = z[(block_lufs > -70.0) & (block_lufs > rel)]
+    return float(-0.691 + 10 * np.log10(gated.mean())), peak
+
+
+def replaygain_for(lufs, peak):
+    """Track gain in dB, limited so the peak does not clip."""
+    if lufs is None:
+        return 0.0
+    gain = REPLAYGAIN_REFERENCE - lufs
+    if peak > 0:
+        gain = min(gain, -20 * math.log10(peak))
+    return round(gain, 2)
+
+
+def read_replaygain(path):
+    from mutagen.id3 import ID3
+
+    try:
+        frame = ID3(path).get("TXXX:REPLAYGAIN_TRACK_GAIN")
+        if frame and frame.text:
+            return float(str(frame.text[0]).split()[0])
+    except Exception:
+        pass
+    return None
+
+
+def write_replaygain(path, gain, peak):
+    from mutagen.id3 import ID3, ID3NoHeaderError, TXXX
+
+    try:
+        try:
+            id3 = ID3(path)
+        except ID3NoHeaderError:
+            id3 = ID3()
+        id3.add(TXXX(encoding=3, desc="REPLAYGAIN_TRACK_GAIN", text=f"{gain:+.2f} dB"))
+        id3.add(TXXX(encoding=3, desc="REPLAYGAIN_TRACK_PEAK", text=f"{peak:.6f}"))
+        id3.save(path)
+        return True
+    except Exception as e:
+        print("write_replaygain error:", e)
+        return False
+
+
+def analyze_loudness(path, data=None, write_tags=False):
+    """Worker: loudness result for one file (plus new size/mtime if tags were written)."""
+    samples, rate = decode_pcm(path, data)
+    lufs, peak = integrated_loudness(samples, rate)
+    result = {"lufs": lufs, "peak": peak, "gain": replaygain_for(lufs, peak)}
+    if write_tags and write_replaygain(path, result["gain"], peak):
+        st = os.stat(path)
+        result.update(tagged=True, size=st.st_size, mtime=st.st_mtime)
+    return result
+
+
+def tag_files(loudness, report=None, scheduler=None):
+    """
+    Write ReplayGain tags from loudness results that are already cached
+    (path -> result), without decoding again. Runs in the device lanes;
+    partial results go to report() like analyze_files().
+    """
+    def tag(path):
+        result = loudness[path]
+        if not write_replaygain(path, result["gain"], result["peak"]):
+            return None
+        st = os.stat(path)
+        return dict(result, tagged=True, size=st.st_size, mtime=st.st_mtime)
+
+    results = {}
+    batch = {}
+    paths = list(loudness)
+    for i, (path, result, err) in enumerate(scheduler.map(tag, paths), 1):
+        if err:
+            print("replaygain error:", path, err)
+        elif result:
+            results[path] = batch[path] = result
+        if report and (len(batch) >= 20 or i == len(paths)):
+            report(f"Writing ReplayGain tags {i}/{len(paths)}...", batch)
+            batch = {}
+    return results
+
+
+def analyze_files(paths, write_tags=False, report=None, scheduler=None):
+    """Loudness of paths on a process pool; partial results go to report()."""
+    results = {}
+    if not paths:
+        return results
+    batch = {}
+    jobs = pool_map(analyze_loudness, paths, write_tags, scheduler=scheduler)
+    for i, (path, result, err) in enumerate(jobs, 1):
+        if err:
+            print("loudness error:", path, err)
+        else:
+            results[path] = batch[path] = result
+        if report and (len(batch) >= 20 or i == len(paths)):
+            report(f"Analyzing loudness {i}/{len(paths)}...", batch)
+            batch = {}
+    return results
+
+
+# ---------------- Genre suggestions ----------------
+FEATURE_RATE = 22050
+FEATURE_SECONDS = 60  # excerpt from the middle of the track
+N_BANDS = 8
+
+
+def extract_features(samples, rate):
+    """
+    Fixed-length feature vector (spectral shape, band energies, dynamics,
+    tempo) from decoded samples. Everything is vectorized over frames.
+    """
+    import numpy as np
+
+    mono = samples.mean(axis=1)
+    step = max(1, int(round(rate / FEATURE_RATE)))
+    if step > 1:
+        n = len(mono) // step * step
+        mono = mono[:n].reshape(-1, step).mean(axis=1)
+        rate = rate / step
+    excerpt = int(FEATURE_SECONDS * rate)
+    if len(mono) > excerpt:
+        start = (len(mono) - excerpt) // 2
+        mono = mono[start:start + excerpt]
+
+    n_fft, hop = 2048, 1024
+    if len(mono) < n_fft * 4:
+        raise ValueError("track too short for features")
+    frames = np.lib.stride_tricks.sliding_window_view(mono, n_fft)[::hop]
+    mag = np.abs(np.fft.rfft(frames * np.hanning(n_fft), axis=1))
+    power = mag ** 2 + 1e-12
+    freqs = np.fft.rfftfreq(n_fft, 1.0 / rate)
+    nyquist = rate / 2
+
+    total = power.sum(axis=1)
+    centroid = (power * freqs).sum(axis=1) / total / nyquist
+    cum = np.cumsum(power, axis=1)
+    rolloff = freqs[np.argmax(cum >= 0.85 * cum[:, -1:], axis=1)] / nyquist
+    flatness = np.exp(np.log(power).mean(axis=1)) / power.mean(axis=1)
+    zcr = (np.abs(np.diff(np.signbit(frames), axis=1)).mean(axis=1))
+    rms = np.log10(np.sqrt((frames ** 2).mean(axis=1)) + 1e-6)
+
+    edges = np.geomspace(40, nyquist, N_BANDS + 1)
+    band_idx = np.clip(np.searchsorted(edges, freqs) - 1, 0, N_BANDS - 1)
+    bands = np.stack([power[:, band_idx == b].sum(axis=1) for b in range(N_BANDS)], axis=1)
+    band_db = 10 * np.log10(bands / total[:, None] + 1e-12).mean(axis=0)
+
+    # tempo: autocorrelation of the spectral-flux onset envelope, 60-200 BPM
+    flux = np.maximum(np.diff(mag, axis=0), 0).sum(axis=1)
+    flux = flux - flux.mean()
+    fps = rate / hop
+    ac = np.correlate(flux, flux, mode="full")[len(flux) - 1:]
+    lo, hi = int(fps * 60 / 200), int(fps * 60 / 60) + 1
+    lag = lo + int(np.argmax(ac[lo:hi])) if hi < len(ac) else lo
+    tempo = 60.0 * fps / lag / 200.0
+    clarity = ac[lag] / ac[0] if ac[0] > 0 else 0.0
+
+    vec = [
+        centroid.mean(), centroid.std(), rolloff.mean(), flatness.mean(), zcr.mean(),
+        rms.mean(), rms.std(), tempo, clarity,
+    ] + list(band_db)
+    return [round(float(v), 5) for v in vec]
+
+
+def audio_features_batch(paths, data=None):
+    """Worker: features for a batch of files. Returns path -> vector (or None)."""
+    out = {}
+    for i, path in enumerate(paths):
+        try:
+            samples, rate = decode_pcm(path, data[i] if data else None)
+            out[path] = extract_features(samples, rate)
+        except Exception as e:
+            print("features error:", path, e)
+            out[path] = None
+    return out
+
+
+def features_for_files(paths, report=None, batch_size=8, scheduler=None):
+    """Extract features in batches on a process pool; partial results go to report()."""
+    results = {}
+    if not paths:
+        return results
+    batches = [tuple(paths[i:i + batch_size]) for i in range(0, len(paths), batch_size)]
+    # each worker reads its own batch one file at a time: preloading whole
+    # batches would buffer 2 * POOL_WORKERS * batch_size files in memory
+    jobs = pool_map(audio_features_batch, batches, scheduler=scheduler, key=lambda b: b[0], load=None)
+    for _paths, batch, err in jobs:
+        if err:
+            print("features batch error:", err)
+            continue
+        results.update(batch)
+        if report:
+            report(f"Extracting features {len(results)}/{len(paths)}...", batch)
+    return results
+
+
+def nearest_centroid(labeled, labels, unlabeled):
+    """
+    Classify feature vectors against per-genre centroids (z-scored features).
+    Returns a list of predicted labels, one per row of `unlabeled`.
+    """
+    import numpy as np
+
+    X = np.asarray(labeled, dtype=np.float64)
+    Y = np.asarray(unlabeled, dtype=np.float64)
+    both = np.vstack([X, Y])
+    mean, std = both.mean(axis=0), both.std(axis=0)
+    std[std == 0] = 1.0
+    X, Y = (X - mean) / std, (Y - mean) / std
+    classes = sorted(set(labels))
+    lab = np.asarray(labels)
+    centroids = np.stack([X[lab == c].mean(axis=0) for c in classes])
+    dist = ((Y[:, None, :] - centroids[None, :, :]) ** 2).sum(axis=2)
+    return [classes[i] for i in dist.argmin(axis=1)]
+
+
+# ---------------- Export ----------------
+def plan_export(items, output_folder, dup_mode, library, exported, scheduler=None, report=None):
+    """
+    Destinations for the (path, genre) items. `library` and `exported` are
+    snapshots of the caches (path -> entry). A file already sitting at the
+    destination, or at a "name (n).mp3" an earlier export picked, is
+    overwritten only when it holds the same recording as the source: it
+    was exported from it, has the same size/mtime (as copy2 leaves it) or
+    the same audio hash. Otherwise the next free "name (n).mp3" is used.
+    Returns (plan, skipped count, hashes computed on the way).
+    """
+    hashes = {}
+    canonical = {}  # path -> first path of its duplicate group
+    if dup_mode != "keep":
+        # Skip/Hardlink need every hash, not only those cached by Find duplicates
+        todo = [p for p, _ in items if not (library.get(p) or {}).get("audio_hash")]
+        hashes = hash_files(todo, report, scheduler)
+        library = dict(library, **{p: dict(library.get(p) or {}, audio_hash=h) for p, h in hashes.items()})
+        for group in group_duplicates([p for p, _ in items], library):
+            for p in group[1:]:
+                canonical[p] = group[0]
+    if dup_mode == "skip":
+        skipped = sum(1 for p, _ in items if p in canonical)
+        items = [(p, g) for p, g in items if p not in canonical]
+    else:
+        skipped = 0
+
+    known = {}  # path -> audio hash, None if it could not be read
+
+    def holds(path, dest, st_dest, hashing=True):
+        """Whether dest holds path's recording; None if that needs hashes (hashing=False)."""
+        entry = exported.get(dest)
+        if not entry_is_fresh(entry, st_dest):
+            entry = None
+        if entry and entry.get("source") == path:
+            return True
+        try:
+            st_src = os.stat(path)
+        except OSError:
+            return False
+        if (st_dest.st_size, st_dest.st_mtime) == (st_src.st_size, st_src.st_mtime):
+            return True
+        for p, cached in ((path, library.get(path)), (dest, entry)):
+            if p not in known:
+                digest = (cached or {}).get("audio_hash")
+                if not digest and not hashing:
+                    return None
+                if not digest:
+                    try:
+                        digest = audio_fingerprint(p)
+                    except OSError as e:
+                        print("hash error:", p, e)
+                known[p] = digest
+        return bool(known[path]) and known[path] == known[dest]
+
+    # hash the files behind name clashes in one pool run; names that an
+    # earlier export numbered are rare and get hashed one by one
+    targets = []
+    wanted = set()
+    for path, genre in items:
+        dest = os.path.abspath(os.path.join(output_folder, safe_name(genre), os.path.basename(path)))
+        targets.append(dest)
+        try:
+            st_dest = os.stat(dest)
+        except OSError:
+            continue
+        if holds(path, dest, st_dest, hashing=False) is None:
+            wanted.update(p for p in (path, dest) if p not in known)
+    found = hash_files(sorted(wanted), report, scheduler)
+    known.update((p, found.get(p)) for p in wanted)
+
+    plan = []  # (path, genre, dest, canonical path to hardlink or None)
+    reserved = set()
+    for (path, genre), dest in zip(items, targets):
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # jangan timpa file lain yang kebetulan namanya sama
+        dest = unique_dest(dest, reserved, lambda cand, st, path=path: holds(path, cand, st))
+        reserved.add(dest)
+        plan.append((path, genre, dest, canonical.get(path) if dup_mode == "hardlink" else None))
+    hashes.update((p, h) for p, h in known.items() if h and p in library)
+    return plan, skipped, hashes
+
+
+def run_export(plan, move, scheduler, report=None):
+    """
+    Copy/move the planned files, spread over the source devices' lanes.
+    Duplicates marked for hardlinking are linked to their canonical copy
+    afterwards (falling back to a copy across filesystems).
+    Returns (done: path -> dest, errors, linked count).
+    """
+    def transfer(item):
+        path, _genre, dest, _canon = item
+        if move:
+            shutil.move(path, dest)
+        else:
+            shutil.copy2(path, dest)
+
+    done, errors = {}, []
+    direct = [item for item in plan if not item[3]]
+    jobs = scheduler.map(transfer, direct, key=lambda item: item[0])
+    for i, (item, _result, err) in enumerate(jobs, 1):
+        if err:
+            errors.append((item[0], str(err)))
+        else:
+            done[item[0]] = item[2]
+        if report and i % 50 == 0:
+            report(f"Exporting {i}/{len(plan)}...")
+
+    linked = 0
+    for item in plan:
+        path, _genre, dest, canon = item
+        if not canon:
+            continue
+        try:
+            source_dest = done.get(canon)
+            if not source_dest:
+                transfer(item)
+            else:
+                if os.path.exists(dest):
+                    os.remove(dest)
+                try:
+                    os.link(source_dest, dest)
+                    linked += 1
+                except OSError:  # beda device / filesystem tanpa hardlink
+                    shutil.copy2(path, dest)
+                if move:
+                    os.remove(path)
+            done[path] = dest
+        except Exception as e:
+            errors.append((path, str(e)))
+    return done, errors, linked
+
+
+# ---------------- Playlists ----------------
+# Smart playlist query (lihat PlaylistQuery): {"name": str, "genre"/"artist"/"album": glob (case-insensitive),
+# "min_duration"/"max_duration": seconds, "tagged_within_days": days}. Empty keys match all.
+PLAYLIST_DIR = "Playlists"
+
+
+def safe_name(text, default="Unknown"):
+    return "".join(c for c in text if c.isalnum() or c in " _-").strip() or default
+
+
+class PlaylistQuery:
+    """Compiled smart playlist query."""
+
+    def __init__(self, query):
+        self.globs = []
+        for field in ("genre", "artist", "album"):
+            if query.get(field):
+                self.globs.append((field, re.compile(fnmatch.translate(query[field]), re.IGNORECASE)))
+        self.min_d = query.get("min_duration")
+        self.max_d = query.get("max_duration")
+        self.days = query.get("tagged_within_days")
+
+    def match(self, entry, now):
+        for field, regex in self.globs:
+            if not regex.match(entry.get(field) or ""):
+                return False
+        if self.min_d is not None or self.max_d is not None:
+            dur = entry.get("duration")
+            if dur is None:
+                return False
+            if self.min_d is not None and dur < self.min_d:
+                return False
+            if self.max_d is not None and dur > self.max_d:
+                return False
+        if self.days is not None:
+            tagged = entry.get("tagged_at")
+            if tagged is None or now - tagged > self.days * 86400:
+                return False
+        return True
+
+    def select(self, files, library, buckets, now):
+        """
+        All matching paths. With a glob on genre/artist/album only the
+        files in matching value buckets are checked, which is much cheaper
+        than testing every file when there are many playlists.
+        """
+        if self.globs:
+            field, regex = self.globs[0]
+            files = [p for value, paths in buckets[field].items() if regex.match(value) for p in paths]
+        return {p for p in files if self.match(library.get(p) or {}, now)}
+
+
+def value_buckets(files, library):
+    buckets = {"genre": {}, "artist": {}, "album": {}}
+    for p in files:
+        entry = library.get(p) or {}
+        for field, index in buckets.items():
+            index.setdefault(entry.get(field) or "", []).append(p)
+    return buckets
+
+
+class PlaylistIndex:
+    """
+    Membership of the smart playlists, kept up to date incrementally:
+    after a retag only the touched files are re-evaluated, and only the
+    playlists whose membership changed are marked for rewriting.
+    """
+
+    def __init__(self):
+        self.queries = {}    # name -> query dict
+        self.members = {}    # name -> set of paths
+        self.changed = set() # names whose membership changed since last write
+        self._preds = {}
+        self._volatile = set()  # depend on the clock (tagged_within_days)
+
+    def set_queries(self, queries, files, library, full=False):
+        """
+        Install the query set. Only new or edited queries are evaluated,
+        unless `full` (the library was rescanned: every membership is stale).
+        """
+        new = {q["name"]: q for q in queries}
+        for name in list(self.queries):
+            if name not in new:
+                self.members.pop(name, None)
+                self.changed.discard(name)
+        for name, query in new.items():
+            if self.queries.get(name) != query or name not in self.members:
+                self._preds[name] = PlaylistQuery(query)
+                self.members[name] = None  # needs full evaluation
+        self.queries = new
+        self._volatile = {n for n, q in new.items() if q.get("tagged_within_days") is not None}
+        names = list(new) if full else [n for n, m in self.members.items() if m is None]
+        self._evaluate_full(names, files, library)
+
+    def _evaluate_full(self, names, files, library, now=None):
+        if not names:
+            return
+        now = time.time() if now is None else now
+        globbed = any(self._preds[n].globs for n in names)
+        buckets = value_buckets(files, library) if globbed else None
+        for name in names:
+            members = self._preds[name].select(files, library, buckets, now)
+            if members != self.members.get(name):
+                self.members[name] = members
+                self.changed.add(name)
+
+    def update(self, paths, library, now=None):
+        """Re-evaluate only `paths` (e.g. after save_pending or undo)."""
+        now = time.time() if now is None else now
+        for name, pred in self._preds.items():
+            if name not in self.queries:
+                continue
+            members = self.members[name]
+            for p in paths:
+                entry = library.get(p)
+                if entry is not None and pred.match(entry, now):
+                    if p not in members:
+                        members.add(p)
+                        self.changed.add(name)
+                elif p in members:
+                    members.discard(p)
+                    self.changed.add(name)
+
+    def refresh_volatile(self, files, library):
+        self._evaluate_full(list(self._volatile), files, library)
+
+
+def render_extm3u(paths, library, base_dir):
+    lines = ["#EXTM3U"]
+    for p in paths:
+        entry = library.get(p) or {}
+        dur = entry.get("duration")
+        title = entry.get("title") or os.path.splitext(os.path.basename(p))[0]
+        if entry.get("artist"):
+            title = f"{entry['artist']} - {title}"
+        try:
+            loc = os.path.relpath(p, base_dir)
+        except ValueError:  # different drive (Windows)
+            loc = p
+        lines.append(f"#EXTINF:{int(round(dur)) if dur else -1},{title}")
+        lines.append(loc)
+    return "\n".join(lines) + "\n"
+
+
+def write_playlist_if_changed(path, text, digests):
+    """Write text to path unless the recorded digest says it is unchanged."""
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    if digests.get(path) == digest and os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as pl:
+        pl.write(text)
+    digests[path] = digest
+    return True
+
+
+# ---------------- Session ----------------
+def load_session(path=SESSION_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            data = json.load(fh)
+        return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print("load_session error:", e)
+        return {}
+
+
+def save_session(data, path=SESSION_PATH):
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        print("save_session error:", e)
+        return False
+
+
 # Helper formatting
 def fmt_time(s):
     try:
@@ -128,24 +1251,68 @@ def fmt_time(s):
         return "0:00:00"
 
 
+# ---------------- List view ----------------
+GROUP_PREFIX = "group::"   # iid of group rows; never a file path
+GROUP_FIELDS = ("", "genre", "artist", "album", "pending")
+
+
+def sorted_view(files, primary, name_key):
+    """Paths ordered by primary[path], ties broken by filename then path."""
+    return sorted(files, key=lambda p: (primary(p), name_key[p], p))
+
+
+def group_view(order, group_key):
+    """Split an ordered list into (label, paths) groups; groups sorted by label."""
+    groups = {}
+    for p in order:
+        groups.setdefault(group_key(p), []).append(p)
+    return sorted(groups.items(), key=lambda kv: (kv[0] == "", kv[0].casefold()))
+
+
 # ---------------- Main App ----------------
 class TastetifyApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, roots=None):
         super().__init__()
         self.title("Tastetify v5 — Final")
         self.geometry("1100x700")
         self.minsize(950, 600)
 
         # State
-        self.input_folder = None
+        self.input_folders = []     # library roots (bisa beda disk / network mount)
+        self.root_limits = {}       # root -> max concurrent I/O jobs on its device
+        self.scheduler = IOScheduler([])
         self.output_folder = None
         self.files = []            # list of absolute paths
+        self.library = {}          # path -> cached metadata (read_library_entry)
         self.genres = [
             "Rock", "Pop", "Jazz", "Hip-Hop", "EDM",
             "Classical", "Metal", "Folk", "Blues", "Other"
         ]
         self.pending_genres = {}   # path -> pending genre
+        self.suggestions = {}      # path -> suggested genre (ditampilkan "Genre?" di kolom pending)
+
+        # list view: presorted orders per column, reused until that column's data changes
+        self.sort_col = None
+        self.sort_desc = False
+        self._sort_cache = {}      # column -> paths in ascending order
+        self._name_key = {}        # path -> casefolded basename (tie-break key)
+        self.view_order = []       # files in display order (for follow-view playback)
+        self._view_pos = {}        # path -> index in view_order
+        self._group_iids = []
+        self._files_pos = {}       # path -> index in files
         self.selection_paths = []  # tree selection (iids)
+        self.genre_rules = []      # ordered rule dicts, lihat evaluate_genre_rules
+        self.smart_playlists = []  # query dicts, lihat PlaylistQuery
+        self.playlist_index = PlaylistIndex()
+        self.playlists_ready = False  # index dibangun lazily di make_playlists
+        self.playlist_digests = {}    # playlist path -> sha1 isi terakhir yang ditulis
+        self.exported = {}            # dest path -> library entry snapshot (export_sorted)
+        self._library_ready = False   # cache loaded (or rescanned): only then it may be saved
+        self._library_save_job = None
+        self._library_writer = ThreadPoolExecutor(max_workers=1)  # writes in request order
+        self._jobs = {}               # running background job -> paths whose tags it may rewrite
+        self._scan_again = False
+        self._start_roots = roots     # from the command line: replace the session's roots once restored
         self.cover_photo = None
 
         # history for undo: list of (path, old_genre, new_genre)
@@ -160,21 +1327,194 @@ class TastetifyApp(tk.Tk):
         self.play_start_time = None  # time.time() saat terakhir play/unpause
         self.play_offset = 0.0       # detik, posisi dalam file saat play_start_time
 
-        if PYGAME_AVAILABLE:
-            pygame.mixer.init()
+        # audio device di-init lazily (lihat _get_mixer)
+        self.mixer_ready = False
+        self._mixer_lock = threading.Lock()
 
         self._build_ui()
         self._bind_shortcuts()
+        self.protocol("WM_DELETE_WINDOW", self._on_close)
 
         # schedule periodic progress UI update
         self.after(500, self._update_progress_ui)
 
+        # window tampil dulu, baru restore sesi & load modul berat di background
+        self.after_idle(self._restore_session)
+        self.after(200, self._start_warmup)
+
+    # ---------------- Startup / session ----------------
+    def _start_warmup(self):
+        threading.Thread(target=self._warmup, daemon=True).start()
+
+    def _warmup(self):
+        # import the heavy modules off the UI thread so the first click is fast
+        try:
+            import mutagen.id3  # noqa: F401
+            import mutagen.mp3  # noqa: F401
+            import PIL.Image  # noqa: F401
+        except Exception:
+            pass
+        self._get_mixer()
+
+    def _get_mixer(self):
+        """Return pygame.mixer, initialising the audio device on first use."""
+        pg = load_pygame()
+        if pg is None:
+            return None
+        with self._mixer_lock:
+            if not self.mixer_ready:
+                try:
+                    pg.mixer.init()
+                    self.mixer_ready = True
+                except Exception as e:
+                    print("mixer init error:", e)
+                    return None
+        return pg.mixer
+
+    def _job_running(self, job):
+        if job in self._jobs:
+            self.status_var.set(f"{job} is already running.")
+            return True
+        return False
+
+    def _files_being_tagged(self):
+        return set().union(*self._jobs.values())
+
+    def run_in_background(self, work, done, partial=None, job=None, writes=()):
+        """
+        Run work(report) on a worker thread; done(result) is then called on
+        the Tk thread. report(msg, items=None) updates the status bar from
+        the worker and, if given, hands items to partial() on the Tk thread.
+        A named job is registered (see _job_running) until it ends; writes
+        are the files whose tags it may rewrite meanwhile.
+        """
+        results = queue.Queue()
+        if job:
+            self._jobs[job] = set(writes)
+
+        def report(msg, items=None):
+            results.put(("status", (msg, items)))
+
+        def runner():
+            try:
+                results.put(("done", work(report)))
+            except Exception as e:
+                traceback.print_exc()
+                results.put(("error", e))
+
+        def poll():
+            try:
+                while True:
+                    kind, value = results.get_nowait()
+                    if kind == "status":
+                        msg, items = value
+                        self.status_var.set(msg)
+                        if items and partial:
+                            partial(items)
+                    elif kind == "done":
+                        self._jobs.pop(job, None)
+                        done(value)
+                        return
+                    else:
+                        self._jobs.pop(job, None)
+                        self.status_var.set(f"Error: {value}")
+                        return
+            except queue.Empty:
+                pass
+            self.after(100, poll)
+
+        threading.Thread(target=runner, daemon=True).start()
+        self.after(100, poll)
+
+    def _session_data(self):
+        return {
+            "version": 1,
+            "input_folders": self.input_folders,
+            "root_limits": self.root_limits,
+            "output_folder": self.output_folder,
+            "genre_rules": self.genre_rules,
+            "smart_playlists": self.smart_playlists,
+            "playlist_digests": self.playlist_digests,
+        }
+
+    def _library_data(self):
+        # snapshot on the Tk thread; entries are copied so the writer never
+        # sees a dict that is being updated
+        return {
+            "version": 1,
+            "files": list(self.files),
+            "library": {p: dict(e) for p, e in self.library.items()},
+            "exported": {p: dict(e) for p, e in self.exported.items()},
+        }
+
+    def _save_session(self):
+        # the small session is written right away, the tag cache a bit later
+        save_session(self._session_data())
+        if self._library_ready and self._library_save_job is None:
+            self._library_save_job = self.after(LIBRARY_SAVE_DELAY_MS, self._save_library)
+
+    def _save_library(self):
+        self._library_save_job = None
+        self._library_writer.submit(save_session, self._library_data(), LIBRARY_PATH)
+
+    def _restore_session(self):
+        data = load_session()
+        self.genre_rules = data.get("genre_rules") or []
+        self.smart_playlists = data.get("smart_playlists") or []
+        self.playlist_digests = data.get("playlist_digests") or {}
+        if data.get("output_folder"):
+            self.output_folder = data["output_folder"]
+            self.output_label_var.set(f"Output: {self.output_folder}")
+        roots = data.get("input_folders") or []
+        if not roots:
+            self._library_ready = True
+            self._use_start_roots()
+            return
+        self.root_limits = data.get("root_limits") or {}
+        self.set_roots(roots, rescan=False)
+        self.status_var.set("Loading library cache...")
+        self.run_in_background(lambda report: load_session(LIBRARY_PATH), self._on_library_loaded)
+
+    def _on_library_loaded(self, data):
+        if self._library_ready:
+            return  # Refresh finished first; its scan is newer than the cache
+        self._library_ready = True
+        self.exported = data.get("exported") or {}
+        library = data.get("library") or {}
+        # cached view only, no disk access; Refresh does the real rescan
+        self.files = [p for p in data.get("files") or [] if p in library]
+        self.library = {p: library[p] for p in self.files}
+        self._populate_tree()
+        self.status_var.set(
+            f"Restored {len(self.files)} MP3 file(s) from last session. Press Refresh to rescan."
+        )
+        self._use_start_roots()
+
+    def _use_start_roots(self):
+        # after the cache is loaded, so the rescan only re-reads changed files
+        roots, self._start_roots = self._start_roots, None
+        if roots:
+            self.set_roots(roots)
+
+    def _on_close(self):
+        # stop background jobs: no more reads, queued pool work is dropped
+        self.scheduler.shutdown(cancel=True)
+        save_session(self._session_data())
+        pending = self._library_save_job
+        if pending is not None:
+            self.after_cancel(pending)
+        self._library_writer.shutdown(wait=True)
+        if pending is not None:
+            save_session(self._library_data(), LIBRARY_PATH)
+        self.destroy()
+
     # ---------------- UI BUILD ----------------
     def _build_ui(self):
         # Top controls (bar atas)
         top = ttk.Frame(self, padding=8)
         top.pack(fill="x")
         ttk.Button(top, text="Select Input Folder", command=self.select_input_folder).pack(side="left", padx=4)
+        ttk.Button(top, text="Library Roots...", command=self.open_roots_dialog).pack(side="left", padx=4)
         ttk.Button(top, text="Select Output Folder", command=self.select_output_folder).pack(side="left", padx=4)
         ttk.Button(top, text="Refresh", command=self.refresh_files).pack(side="left", padx=4)
 
@@ -231,7 +1571,16 @@ class TastetifyApp(tk.Tk):
         # MP3 list kecil di bawah cover
         list_frame = ttk.Frame(info_frame)
         list_frame.grid(row=1, column=0, sticky="nsew")
-        ttk.Label(list_frame, text="MP3 Files").pack(anchor="w")
+        list_head = ttk.Frame(list_frame)
+        list_head.pack(side="top", fill="x")
+        ttk.Label(list_head, text="MP3 Files").pack(side="left")
+        self.follow_view_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(list_head, text="Play in view order", variable=self.follow_view_var).pack(side="right")
+        self.group_var = tk.StringVar(value="")
+        group_combo = ttk.Combobox(list_head, values=GROUP_FIELDS, textvariable=self.group_var, width=8, state="readonly")
+        group_combo.pack(side="right", padx=(0, 8))
+        group_combo.bind("<<ComboboxSelected>>", lambda e: self._apply_view())
+        ttk.Label(list_head, text="Group by:").pack(side="right", padx=(0, 4))
 
         cols = ("filename", "genre", "pending")
         self.tree = ttk.Treeview(
@@ -241,9 +1590,10 @@ class TastetifyApp(tk.Tk):
             selectmode="extended",
             height=8,
         )
-        self.tree.heading("filename", text="Filename")
-        self.tree.heading("genre", text="Genre")
-        self.tree.heading("pending", text="Pending")
+        for col in cols:
+            self.tree.heading(col, command=lambda c=col: self.sort_by(c))
+        self._update_headings()
+        self.tree.column("#0", width=180, stretch=False)
         self.tree.column("filename", width=360, anchor="w")
         self.tree.column("genre", width=120, anchor="w")
         self.tree.column("pending", width=120, anchor="w")
@@ -275,6 +1625,17 @@ class TastetifyApp(tk.Tk):
         ttk.Button(tag_frame, text="Clear Tag (Remove)", command=self.clear_tag_selected).grid(
             row=3, column=0, columnspan=2, sticky="ew", pady=(6, 0)
         )
+        ttk.Button(tag_frame, text="Genre Rules...", command=self.open_rules_dialog).grid(
+            row=4, column=0, columnspan=2, sticky="ew", pady=(6, 0)
+        )
+        suggest_row = ttk.Frame(tag_frame)
+        suggest_row.grid(row=5, column=0, columnspan=2, sticky="ew", pady=(6, 0))
+        ttk.Button(suggest_row, text="Suggest Genres", command=self.suggest_genres).pack(
+            side="left", fill="x", expand=True
+        )
+        ttk.Button(suggest_row, text="Accept Suggestion", command=self.accept_suggestions).pack(
+            side="left", fill="x", expand=True, padx=(6, 0)
+        )
 
         # Playback frame
         play_frame = ttk.LabelFrame(right, text="Playback", padding=8)
@@ -319,10 +1680,29 @@ class TastetifyApp(tk.Tk):
         )
         self.volume_scale.pack(fill="x", expand=True, padx=6)
 
+        rg_row = ttk.Frame(play_frame)
+        rg_row.pack(fill="x", pady=(6, 0))
+        self.normalize_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(
+            rg_row, text="ReplayGain", variable=self.normalize_var,
+            command=lambda: self.on_volume_change(self.volume_var.get()),
+        ).pack(side="left")
+        self.write_rg_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(rg_row, text="Write tags", variable=self.write_rg_var).pack(side="left", padx=6)
+        ttk.Button(rg_row, text="Analyze Loudness", command=self.analyze_loudness).pack(side="right")
+
         exp_frame = ttk.LabelFrame(right, text="Export & Playlists", padding=8)
         exp_frame.pack(fill="x", pady=(8, 8))
         ttk.Button(exp_frame, text="Export Sorted (by genre)", command=self.export_sorted).pack(fill="x", pady=4)
         ttk.Button(exp_frame, text="Make Playlists (.m3u) in Output", command=self.make_playlists).pack(fill="x", pady=4)
+        ttk.Button(exp_frame, text="Smart Playlists...", command=self.open_playlists_dialog).pack(fill="x", pady=4)
+        ttk.Button(exp_frame, text="Find Duplicates", command=self.find_duplicates).pack(fill="x", pady=4)
+        dup_row = ttk.Frame(exp_frame)
+        dup_row.pack(fill="x")
+        ttk.Label(dup_row, text="Duplicates on export:").pack(side="left")
+        self.dup_var = tk.StringVar(value="keep")
+        for text, value in (("Keep", "keep"), ("Skip", "skip"), ("Hardlink", "hardlink")):
+            ttk.Radiobutton(dup_row, text=text, variable=self.dup_var, value=value).pack(side="left")
 
         self.status_var = tk.StringVar(value="Ready")
         status = ttk.Label(self, textvariable=self.status_var, relief="sunken", anchor="w")
@@ -348,10 +1728,26 @@ class TastetifyApp(tk.Tk):
         folder = filedialog.askdirectory(title="Select input folder with MP3 files")
         if not folder:
             return
-        self.input_folder = folder
-        self.input_label_var.set(f"Input: {folder}")
         self.status_var.set(f"Input folder set to: {folder}")
-        self.refresh_files()
+        self.set_roots([folder])
+
+    def set_roots(self, roots, rescan=True):
+        """Replace the library roots; rebuilds the per-device I/O lanes."""
+        self.input_folders = [os.path.abspath(r) for r in roots]
+        self.root_limits = {r: n for r, n in self.root_limits.items() if r in self.input_folders}
+        self.scheduler.shutdown()
+        self.scheduler = IOScheduler(self.input_folders, self.root_limits)
+        if not self.input_folders:
+            self.input_label_var.set("Input: (none)")
+        elif len(self.input_folders) == 1:
+            self.input_label_var.set(f"Input: {self.input_folders[0]}")
+        else:
+            self.input_label_var.set(f"Input: {self.input_folders[0]} (+{len(self.input_folders) - 1} more root(s))")
+        if rescan:
+            self.refresh_files()
+
+    def open_roots_dialog(self):
+        RootsDialog(self)
 
     def select_output_folder(self):
         folder = filedialog.askdirectory(title="Select output folder")
@@ -360,11 +1756,14 @@ class TastetifyApp(tk.Tk):
         self.output_folder = folder
         self.output_label_var.set(f"Output: {folder}")
         self.status_var.set(f"Output folder set to: {folder}")
+        self._save_session()
 
-    def refresh_files(self):
+    def _reset_view(self):
         self.tree.delete(*self.tree.get_children())
+        self._group_iids = []
         self.files = []
         self.pending_genres.clear()
+        self.suggestions.clear()
         self.selection_paths.clear()
         self.cover_photo = None
         self.cover_label.config(image="", text="No cover")
@@ -377,28 +1776,146 @@ class TastetifyApp(tk.Tk):
         self.time_label.config(text="00:00:00 / 00:00:00")
         self.progress_var.set(0)
 
-        if not getattr(self, "input_folder", None):
-            return
-        folder = self.input_folder
-        pattern = os.path.join(folder, "**", "*.mp3")
-        files = glob.glob(pattern, recursive=True)
-        files.sort()
-        self.files = [os.path.abspath(f) for f in files]
+    def _populate_tree(self):
+        self._sort_cache.clear()
+        self._name_key = {p: os.path.basename(p).casefold() for p in self.files}
         for path in self.files:
             base = os.path.basename(path)
-            g = read_genre(path) or ""
+            g = self.library.get(path, {}).get("genre", "")
             self.tree.insert("", "end", iid=path, values=(base, g, ""))
+        self.view_order = list(self.files)
+        self._view_pos = {p: i for i, p in enumerate(self.view_order)}
+        self._files_pos = {}  # new file list: rebuilt on the next skip
+        if self.sort_col or self.group_var.get():
+            self._apply_view()
+
+    # ---------------- Sorting & grouping ----------------
+    def _field_key(self, field):
+        if field == "filename":
+            return lambda p: self._name_key[p]
+        if field == "pending":
+            return lambda p: self._pending_text(p).casefold()
+        library = self.library
+        return lambda p: ((library.get(p) or {}).get(field) or "").casefold()
+
+    def _group_label(self, field):
+        if field == "pending":
+            return self._pending_text
+        library = self.library
+        return lambda p: (library.get(p) or {}).get(field) or ""
+
+    def _invalidate_sort(self, *cols):
+        for col in cols:
+            self._sort_cache.pop(col, None)
+
+    def _update_headings(self):
+        for col, text in (("filename", "Filename"), ("genre", "Genre"), ("pending", "Pending")):
+            if col == self.sort_col:
+                text += " ▼" if self.sort_desc else " ▲"
+            self.tree.heading(col, text=text)
+
+    def sort_by(self, col):
+        if self.sort_col == col:
+            self.sort_desc = not self.sort_desc
+        else:
+            self.sort_col, self.sort_desc = col, False
+        self._update_headings()
+        self._apply_view()
+
+    def _apply_view(self):
+        """
+        Reorder the list from the presorted column orders. Items are placed
+        with a single `set_children` call per parent instead of moving rows
+        one by one, which is what keeps this fast at 100k rows.
+        """
+        if self.sort_col:
+            order = self._sort_cache.get(self.sort_col)
+            if order is None:
+                order = self._sort_cache[self.sort_col] = sorted_view(
+                    self.files, self._field_key(self.sort_col), self._name_key
+                )
+            if self.sort_desc:
+                order = order[::-1]
+        else:
+            order = self.files
+
+        group_field = self.group_var.get()
+        old_groups, self._group_iids = self._group_iids, []
+        if group_field:
+            groups = group_view(order, self._group_label(group_field))
+            flat = []
+            for label, paths in groups:
+                iid = GROUP_PREFIX + label
+                if self.tree.exists(iid):
+                    self.tree.item(iid, text=f"{label or '(none)'} ({len(paths)})", open=True)
+                else:
+                    self.tree.insert("", "end", iid=iid, text=f"{label or '(none)'} ({len(paths)})", open=True)
+                self.tree.set_children(iid, *paths)
+                self._group_iids.append(iid)
+                flat.extend(paths)
+            self.tree.set_children("", *self._group_iids)
+            self.tree.configure(show="tree headings")
+            order = flat
+        else:
+            self.tree.set_children("", *order)
+            self.tree.configure(show="headings")
+        current = set(self._group_iids)
+        stale = [g for g in old_groups if g not in current]
+        if stale:
+            self.tree.delete(*stale)
+
+        self.view_order = list(order)
+        self._view_pos = {p: i for i, p in enumerate(self.view_order)}
+
+    def refresh_files(self):
+        if "Scan" in self._jobs:
+            # roots may have changed meanwhile: scan again once this one ends
+            self._scan_again = True
+            return
+        if not self.input_folders:
+            self._reset_view()
+            return
+        # a slow mount only delays its own lane, and no longer the UI
+        roots, cached, scheduler = list(self.input_folders), self.library, self.scheduler
+        self.status_var.set(f"Scanning {len(roots)} root(s)...")
+        self.run_in_background(
+            lambda report: scan_library(roots, cached, scheduler, report), self._on_scan_done, job="Scan"
+        )
+
+    def _on_scan_done(self, result):
+        if self._scan_again:
+            self._scan_again = False
+            self.refresh_files()
+            return
+        self._reset_view()
+        self.files, self.library = result
+        self._library_ready = True
+        self.playlists_ready = False
+        self._populate_tree()
         self.status_var.set(f"Loaded {len(self.files)} MP3 file(s).")
+        self._save_session()
+
+    def _selected_files(self):
+        # a selected group row stands for all files in it
+        paths = []
+        for iid in self.tree.selection():
+            if iid.startswith(GROUP_PREFIX):
+                paths.extend(self.tree.get_children(iid))
+            else:
+                paths.append(iid)
+        return list(dict.fromkeys(paths))
 
     def on_tree_select(self, event=None):
-        sel = self.tree.selection()
-        self.selection_paths = list(sel)
+        sel = self._selected_files()
+        self.selection_paths = sel
         if sel:
             self._preview_file(sel[0])
 
     def _preview_file(self, path):
-        tags = read_basic_tags(path)
-        gen = self.pending_genres.get(path) or read_genre(path) or "(none)"
+        from PIL import Image, ImageTk
+
+        tags = self.library.get(path) or read_basic_tags(path)
+        gen = self.pending_genres.get(path) or tags.get("genre") or "(none)"
         info_lines = [
             f"File: {os.path.basename(path)}",
             f"Title: {tags.get('title') or '—'}",
@@ -428,6 +1945,12 @@ class TastetifyApp(tk.Tk):
             self.cover_label.config(image="", text="No cover")
 
     # ---------------- Tagging & history ----------------
+    def _saved_genre(self, path):
+        entry = self.library.get(path)
+        if entry is not None:
+            return entry.get("genre") or ""
+        return read_genre(path) or ""
+
     def assign_genre(self):
         genre = self.genre_var.get().strip()
         if not genre:
@@ -437,11 +1960,12 @@ class TastetifyApp(tk.Tk):
             messagebox.showinfo("Select files", "Select one or more files in the list.")
             return
         for p in self.selection_paths:
-            old = read_genre(p) or ""
+            old = self._saved_genre(p)
             self.history.append((p, old, genre))
             self.pending_genres[p] = genre
             if self.tree.exists(p):
                 self.tree.set(p, "pending", genre)
+        self._invalidate_sort("pending")
         self.status_var.set(f"Assigned pending genre '{genre}' to {len(self.selection_paths)} file(s).")
 
     def add_genre(self):
@@ -461,13 +1985,52 @@ class TastetifyApp(tk.Tk):
             messagebox.showinfo("Select files", "Select one or more files in the list.")
             return
         for p in self.selection_paths:
-            old = read_genre(p) or ""
+            old = self._saved_genre(p)
             self.history.append((p, old, ""))
             self.pending_genres[p] = ""
             if self.tree.exists(p):
                 self.tree.set(p, "pending", "")
+        self._invalidate_sort("pending")
         self.status_var.set(f"Marked {len(self.selection_paths)} file(s) to clear genre.")
 
+    def _restat_entry(self, path):
+        # a tag write leaves the audio frames untouched, so the audio-derived
+        # cache (audio_hash, ...) stays valid: just record the new size/mtime
+        try:
+            st = os.stat(path)
+            self.library[path].update(size=st.st_size, mtime=st.st_mtime)
+        except OSError:
+            pass
+
+    def _pending_text(self, path):
+        if path in self.pending_genres:
+            return self.pending_genres[path]
+        if path in self.suggestions:
+            return f"{self.suggestions[path]}?"
+        return ""
+
+    def _library_changed(self, paths):
+        # keep smart playlist membership current without a full re-evaluation
+        if self.playlists_ready:
+            self.playlist_index.update(paths, self.library)
+
+    # ---------------- Genre rules ----------------
+    def open_rules_dialog(self):
+        RulesDialog(self)
+
+    def commit_rule_diff(self, diff):
+        """Add a rules dry-run diff to pending changes as one batch."""
+        for path, _old, genre in diff:
+            self.history.append((path, self._saved_genre(path), genre))
+            self.pending_genres[path] = genre
+            if self.tree.exists(path):
+                self.tree.set(path, "pending", genre)
+            if genre and genre not in self.genres:
+                self.genres.append(genre)
+        self.genre_combo.config(values=self.genres)
+        self._invalidate_sort("pending")
+        self.status_var.set(f"Rules: {len(diff)} file(s) added to pending. Save with Ctrl+S.")
+
     # ---------------- Save pending ----------------
     def save_pending(self, event=None):
         if not self.pending_genres:
@@ -475,27 +2038,45 @@ class TastetifyApp(tk.Tk):
             return
         errors = []
         saved_count = 0
+        saved = []
+        # a background job may be writing ReplayGain tags to these: keep them pending
+        busy = self._files_being_tagged()
+        held = 0
 
         for path, genre in list(self.pending_genres.items()):
+            if path in busy:
+                held += 1
+                continue
             try:
                 ok = write_genre(path, genre)
                 if ok:
                     saved_count += 1
+                    self.suggestions.pop(path, None)
                     if self.tree.exists(path):
                         self.tree.set(path, "genre", genre)
                         self.tree.set(path, "pending", "")
+                    if path in self.library:
+                        self.library[path]["genre"] = genre
+                        self.library[path]["tagged_at"] = time.time()
+                        self._restat_entry(path)
                     del self.pending_genres[path]
+                    saved.append(path)
                 else:
                     errors.append((path, "write_genre failed"))
             except Exception as e:
                 errors.append((path, str(e)))
 
         msg = f"Saved {saved_count} items."
+        if held:
+            msg += f" {held} file(s) are being tagged in the background and stay pending; save again later."
         if errors:
             msg += f" Failed for {len(errors)} files. See console."
             traceback.print_exc()
         self.status_var.set(msg)
         messagebox.showinfo("Save completed", msg)
+        self._library_changed(saved)
+        self._invalidate_sort("genre", "pending")
+        self._save_session()
         if self.selection_paths:
             self._preview_file(self.selection_paths[0])
 
@@ -504,16 +2085,24 @@ class TastetifyApp(tk.Tk):
         if not self.history:
             messagebox.showinfo("Undo", "No action to undo.")
             return
+        if self.history[-1][0] in self._files_being_tagged():
+            messagebox.showinfo("Undo", "That file is being tagged in the background; try again when it is done.")
+            return
         path, old, new = self.history.pop()
         try:
             if path in self.pending_genres:
                 del self.pending_genres[path]
             if self.tree.exists(path):
-                self.tree.set(path, "pending", "")
+                self.tree.set(path, "pending", self._pending_text(path))
             ok = write_genre(path, old)
             if ok:
                 if self.tree.exists(path):
                     self.tree.set(path, "genre", old)
+                if path in self.library:
+                    self.library[path]["genre"] = old
+                    self._restat_entry(path)
+                self._library_changed([path])
+                self._invalidate_sort("genre", "pending")
                 self.status_var.set(f"Undo: {os.path.basename(path)} -> '{old or '(none)'}'")
             else:
                 messagebox.showerror("Undo error", "Failed to restore previous genre.")
@@ -535,33 +2124,34 @@ class TastetifyApp(tk.Tk):
     def play_song(self, path, start_pos=None):
         if path is None:
             return
-        if not PYGAME_AVAILABLE:
+        mixer = self._get_mixer()
+        if mixer is None:
             self.status_var.set("Playback unavailable: pygame not installed.")
             return
         try:
             try:
-                pygame.mixer.music.stop()
+                mixer.music.stop()
             except Exception:
                 pass
 
-            pygame.mixer.music.load(path)
+            mixer.music.load(path)
             if start_pos is None:
-                pygame.mixer.music.play()
+                mixer.music.play()
                 self._set_play_position(0.0)
             else:
                 sp = float(start_pos)
                 try:
-                    pygame.mixer.music.play(start=sp)
+                    mixer.music.play(start=sp)
                 except TypeError:
-                    pygame.mixer.music.play()
+                    mixer.music.play()
                     sp = 0.0
                 except Exception:
-                    pygame.mixer.music.play()
+                    mixer.music.play()
                     sp = 0.0
                 self._set_play_position(sp)
 
-            pygame.mixer.music.set_volume(self.volume_var.get())
             self.current_playing = path
+            mixer.music.set_volume(self._track_volume(self.volume_var.get()))
             self.paused = False
             self.current_duration = get_duration_seconds(path) or 0.0
             self.status_var.set(f"Playing: {os.path.basename(path)}")
@@ -574,28 +2164,26 @@ class TastetifyApp(tk.Tk):
             self.status_var.set("Error playing file.")
 
     def play_selected(self):
-        sel = self.tree.selection()
+        sel = self._selected_files()
         if not sel:
             messagebox.showinfo("Select file", "Select a file to play.")
             return
         path = sel[0]
-        self.selection_paths = list(sel)
+        self.selection_paths = sel
         self._preview_file(path)
         self.play_song(path)
 
     def play_next(self, event=None):
-        if not self.files:
+        order, pos = self._play_order()
+        if not order:
             return
         if not self.current_playing:
-            current = self.selection_paths[0] if self.selection_paths else self.files[0]
+            current = self.selection_paths[0] if self.selection_paths else order[0]
         else:
             current = self.current_playing
-        try:
-            idx = self.files.index(current)
-        except ValueError:
-            idx = -1
-        next_idx = (idx + 1) % len(self.files)
-        path = self.files[next_idx]
+        idx = pos.get(current, -1)
+        next_idx = (idx + 1) % len(order)
+        path = order[next_idx]
         self.tree.selection_set(path)
         self.tree.see(path)
         self.selection_paths = [path]
@@ -603,26 +2191,31 @@ class TastetifyApp(tk.Tk):
         self.play_song(path)
 
     def play_prev(self, event=None):
-        if not self.files:
+        order, pos = self._play_order()
+        if not order:
             return
         if not self.current_playing:
-            current = self.selection_paths[0] if self.selection_paths else self.files[0]
+            current = self.selection_paths[0] if self.selection_paths else order[0]
         else:
             current = self.current_playing
-        try:
-            idx = self.files.index(current)
-        except ValueError:
-            idx = 0
-        prev_idx = (idx - 1) % len(self.files)
-        path = self.files[prev_idx]
+        idx = pos.get(current, 0)
+        prev_idx = (idx - 1) % len(order)
+        path = order[prev_idx]
         self.tree.selection_set(path)
         self.tree.see(path)
         self.selection_paths = [path]
         self._preview_file(path)
         self.play_song(path)
 
+    def _play_order(self):
+        if self.follow_view_var.get() and len(self.view_order) == len(self.files):
+            return self.view_order, self._view_pos
+        if not self._files_pos:
+            self._files_pos = {p: i for i, p in enumerate(self.files)}
+        return self.files, self._files_pos
+
     def toggle_pause(self):
-        if not PYGAME_AVAILABLE or not self.current_playing:
+        if not self.mixer_ready or not self.current_playing:
             return
         try:
             if not self.paused:
@@ -642,7 +2235,7 @@ class TastetifyApp(tk.Tk):
             print("pause error:", e)
 
     def stop_song(self):
-        if not PYGAME_AVAILABLE:
+        if not self.mixer_ready:
             return
         try:
             pygame.mixer.music.stop()
@@ -658,7 +2251,7 @@ class TastetifyApp(tk.Tk):
         self.progress_var.set(0)
 
     def _check_autoplay(self):
-        if not PYGAME_AVAILABLE or self.current_playing is None:
+        if not self.mixer_ready or self.current_playing is None:
             return
         cur = self._current_position()
         dur = self.current_duration or 0.0
@@ -690,7 +2283,7 @@ class TastetifyApp(tk.Tk):
             pass
 
     def seek_to(self, seconds):
-        if not PYGAME_AVAILABLE or not self.current_playing:
+        if not self.mixer_ready or not self.current_playing:
             return
         seconds = max(0.0, float(seconds))
         if self.current_duration and seconds > self.current_duration:
@@ -713,7 +2306,7 @@ class TastetifyApp(tk.Tk):
             print("seek error:", e)
 
     def seek_relative(self, delta_seconds):
-        if not PYGAME_AVAILABLE or not self.current_playing:
+        if not self.mixer_ready or not self.current_playing:
             return
         try:
             cur = self._current_position()
@@ -729,11 +2322,28 @@ class TastetifyApp(tk.Tk):
     def on_volume_change(self, value):
         try:
             v = float(value)
-            if PYGAME_AVAILABLE:
-                pygame.mixer.music.set_volume(v)
+            if self.mixer_ready:
+                pygame.mixer.music.set_volume(self._track_volume(v))
         except Exception:
             pass
 
+    def _track_gain(self, path):
+        entry = self.library.get(path) or {}
+        if "loudness" in entry:
+            return entry["loudness"]["gain"]
+        if "rg_tag" not in entry:
+            # belum dianalisis: pakai tag ReplayGain dari file kalau ada
+            entry["rg_tag"] = read_replaygain(path)
+        return entry["rg_tag"]
+
+    def _track_volume(self, volume):
+        if not self.current_playing or not self.normalize_var.get():
+            return volume
+        gain = self._track_gain(self.current_playing)
+        if gain is None:
+            gain = 0.0  # unknown: assume the reference level, same headroom as the rest
+        return max(0.0, min(1.0, volume * 10 ** ((gain - PLAYBACK_HEADROOM_DB) / 20.0)))
+
     def _seek_bindings(self):
         self.progress.bind("<ButtonRelease-1>", lambda e: self._on_progress_release())
 
@@ -748,12 +2358,14 @@ class TastetifyApp(tk.Tk):
 
     # ---------------- Export / Playlists ----------------
     def export_sorted(self):
+        if self._job_running("Export"):
+            return
         if not getattr(self, "output_folder", None):
             messagebox.showinfo("Choose output", "Please choose an output folder first.")
             return
         to_process = []
         for path in list(self.files):
-            genre = self.pending_genres.get(path) or read_genre(path)
+            genre = self.pending_genres.get(path) or self._saved_genre(path)
             if not genre:
                 continue
             to_process.append((path, genre))
@@ -761,21 +2373,31 @@ class TastetifyApp(tk.Tk):
             messagebox.showinfo("Nothing to export", "No files have a genre (including pending).")
             return
         move = (self.move_var.get() == "move")
-        errors = []
-        for path, genre in to_process:
-            safe_genre = "".join(c for c in genre if c.isalnum() or c in " _-").strip() or "Unknown"
-            dest_dir = os.path.join(self.output_folder, safe_genre)
-            os.makedirs(dest_dir, exist_ok=True)
-            base = os.path.basename(path)
-            dest = os.path.join(dest_dir, base)
-            try:
-                if move:
-                    shutil.move(path, dest)
-                else:
-                    shutil.copy2(path, dest)
-            except Exception as e:
-                errors.append((path, str(e)))
-        msg = f"Exported {len(to_process)} files to '{self.output_folder}' ({'moved' if move else 'copied'})."
+        dup_mode = self.dup_var.get()
+        output_folder = self.output_folder
+        library = {p: self.library.get(p) or {} for p, _ in to_process}
+        exported = dict(self.exported)
+        scheduler = self.scheduler
+
+        def work(report):
+            # planning stats (and maybe hashes) files, so it runs off the Tk thread too
+            plan, skipped, hashes = plan_export(
+                to_process, output_folder, dup_mode, library, exported, scheduler, report
+            )
+            return plan, skipped, hashes, run_export(plan, move, scheduler, report)
+
+        self.status_var.set(f"Exporting {len(to_process)} file(s)...")
+        self.run_in_background(work, lambda result: self._on_export_done(*result, move), job="Export")
+
+    def _on_export_done(self, plan, skipped, hashes, result, move):
+        self._store_hashes(hashes)
+        done, errors, linked = result
+        for path, genre, dest, _canon in plan:
+            if path in done:
+                self.exported[dest] = dict(self.library.get(path) or {}, genre=genre, source=path)
+        msg = f"Exported {len(done)} files to '{self.output_folder}' ({'moved' if move else 'copied'})."
+        if skipped or linked:
+            msg += f"  Duplicates: {skipped} skipped, {linked} hardlinked."
         if errors:
             msg += f"  Failed for {len(errors)} file(s)."
             print("Export errors:")
@@ -783,50 +2405,681 @@ class TastetifyApp(tk.Tk):
                 print(p, "->", err)
         messagebox.showinfo("Export", msg)
         self.status_var.set(msg)
+        self._save_session()
         if move:
             self.refresh_files()
 
     def make_playlists(self):
+        if self._job_running("Playlists"):
+            return
         if not getattr(self, "output_folder", None):
             messagebox.showinfo("Choose output", "Please choose an output folder first.")
             return
-        base = self.output_folder
-        genre_dirs = []
-        for root, dirs, files in os.walk(base):
-            if root == base:
-                for d in dirs:
-                    genre_dirs.append(os.path.join(base, d))
-                break
-        if not genre_dirs:
-            messagebox.showinfo("No genre folders", "No genre folders found in output.")
-            return
-        created = 0
-        for gdir in genre_dirs:
-            mp3s = [f for f in os.listdir(gdir) if f.lower().endswith(".mp3")]
-            if not mp3s:
+        # tags of files not exported from here (or changed since) are read in the background
+        base = os.path.abspath(self.output_folder)
+        cached, scheduler = dict(self.exported), self.scheduler
+        self.status_var.set("Indexing output folder...")
+        self.run_in_background(
+            lambda report: index_output(base, cached, scheduler, report),
+            lambda found: self._write_playlists(base, found),
+            job="Playlists",
+        )
+
+    def _write_playlists(self, base, found):
+        # self.exported is only a metadata cache of the output: forget deleted files
+        for path in [p for p in self.exported if os.path.dirname(os.path.dirname(p)) == base]:
+            if path not in found:
+                del self.exported[path]
+        self.exported.update(found)
+        written = total = 0
+        errors = []
+
+        # per-genre playlists next to the exported files (bare filenames)
+        by_dir = {}
+        for dest in found:
+            by_dir.setdefault(os.path.dirname(dest), []).append(dest)
+        for gdir, paths in by_dir.items():
+            paths.sort()
+            playlist_path = os.path.join(gdir, f"{os.path.basename(gdir)}.m3u")
+            total += 1
+            try:
+                written += write_playlist_if_changed(
+                    playlist_path, render_extm3u(paths, self.exported, gdir), self.playlist_digests
+                )
+            except Exception as e:
+                errors.append((playlist_path, str(e)))
+
+        # smart playlists, evaluated against the library index
+        if not self.playlists_ready:
+            # first use or after a rescan: evaluate every query on the new library
+            self.playlist_index.set_queries(self.smart_playlists, self.files, self.library, full=True)
+            self.playlists_ready = True
+        else:
+            self.playlist_index.refresh_volatile(self.files, self.library)
+        pl_dir = os.path.join(self.output_folder, PLAYLIST_DIR)
+        order = None
+        for query in self.smart_playlists:
+            name = query["name"]
+            playlist_path = self._smart_playlist_path(name)
+            total += 1
+            if name not in self.playlist_index.changed and os.path.exists(playlist_path):
                 continue
-            mp3s.sort()
-            genre_name = os.path.basename(gdir)
-            playlist_path = os.path.join(gdir, f"{genre_name}.m3u")
+            if order is None:
+                order = {p: i for i, p in enumerate(self.files)}
+            paths = sorted(self.playlist_index.members.get(name) or (), key=order.get)
             try:
-                with open(playlist_path, "w", encoding="utf-8") as pl:
-                    for f in mp3s:
-                        pl.write(f + "\n")
-                created += 1
+                written += write_playlist_if_changed(
+                    playlist_path, render_extm3u(paths, self.library, pl_dir), self.playlist_digests
+                )
+                self.playlist_index.changed.discard(name)
             except Exception as e:
-                print("Playlist write error:", e)
-        messagebox.showinfo("Playlists", f"Created {created} playlist(s).")
-        self.status_var.set(f"Created {created} playlist(s) in output subfolders.")
+                errors.append((playlist_path, str(e)))
+
+        if not total:
+            messagebox.showinfo("No playlists", "No exported files or smart playlists found.")
+            return
+        msg = f"Playlists: {written} written, {total - written - len(errors)} unchanged."
+        if errors:
+            msg += f"  Failed for {len(errors)} playlist(s)."
+            for p, err in errors:
+                print("Playlist write error:", p, "->", err)
+        self._save_session()
+        messagebox.showinfo("Playlists", msg)
+        self.status_var.set(msg)
+
+    # ---------------- Duplicates ----------------
+    def find_duplicates(self):
+        if self._job_running("Duplicate search"):
+            return
+        if not self.files:
+            messagebox.showinfo("Duplicates", "Load an input folder first.")
+            return
+        # hashes are cached in the library entries (valid while size/mtime match)
+        todo = [p for p in self.files if not (self.library.get(p) or {}).get("audio_hash")]
+        self.status_var.set(f"Hashing audio of {len(todo)} file(s)...")
+        scheduler = self.scheduler
+        self.run_in_background(
+            lambda report: hash_files(todo, report, scheduler), self._on_hashes_done, job="Duplicate search"
+        )
+
+    def _store_hashes(self, hashes):
+        for path, digest in hashes.items():
+            if path in self.library:
+                self.library[path]["audio_hash"] = digest
+
+    def _on_hashes_done(self, hashes):
+        self._store_hashes(hashes)
+        self._save_session()
+        groups = group_duplicates(self.files, self.library)
+        extra = sum(len(g) - 1 for g in groups)
+        self.status_var.set(f"Found {len(groups)} duplicate group(s), {extra} redundant file(s).")
+        if groups:
+            DuplicatesDialog(self, groups)
+        else:
+            messagebox.showinfo("Duplicates", "No duplicates found.")
+
+    # ---------------- Loudness ----------------
+    def analyze_loudness(self):
+        if self._job_running("Loudness analysis"):
+            return
+        if not self.files:
+            messagebox.showinfo("Loudness", "Load an input folder first.")
+            return
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            messagebox.showerror("Loudness", "Loudness analysis needs numpy (pip install numpy).")
+            return
+        write_tags = self.write_rg_var.get()
+        # cached per file identity; an interrupted run resumes where it stopped
+        todo = [p for p in self.files if "loudness" not in (self.library.get(p) or {})]
+        # analyzed earlier without "Write tags": only the tags are missing
+        retag = {}
+        if write_tags:
+            for p in self.files:
+                loudness = (self.library.get(p) or {}).get("loudness")
+                if loudness and not loudness.get("tagged"):
+                    retag[p] = loudness
+        if not todo and not retag:
+            self.status_var.set("Loudness: all files already analyzed.")
+            return
+        self._loudness_saved_at = time.time()
+        self.status_var.set(f"Analyzing loudness of {len(todo)} file(s)...")
+        scheduler = self.scheduler
+
+        def work(report):
+            tagged = tag_files(retag, report, scheduler)
+            return analyze_files(todo, write_tags, report, scheduler), tagged
+
+        self.run_in_background(
+            work, self._on_loudness_done, partial=self._on_loudness_batch,
+            job="Loudness analysis", writes=(set(todo) | set(retag)) if write_tags else (),
+        )
+
+    def _on_loudness_batch(self, batch):
+        for path, result in batch.items():
+            entry = self.library.get(path)
+            if entry is None:
+                continue
+            if "size" in result:
+                entry.update(size=result.pop("size"), mtime=result.pop("mtime"))
+            entry["loudness"] = result
+            entry.pop("rg_tag", None)
+        if time.time() - self._loudness_saved_at > 30:
+            self._loudness_saved_at = time.time()
+            self._save_session()
+
+    def _on_loudness_done(self, results):
+        analyzed, tagged = results
+        self._save_session()
+        msg = f"Loudness analyzed for {len(analyzed)} file(s)."
+        if tagged:
+            msg += f"  ReplayGain tags written for {len(tagged)} analyzed earlier."
+        self.status_var.set(msg)
+        self.on_volume_change(self.volume_var.get())
+
+    # ---------------- Genre suggestions ----------------
+    def suggest_genres(self):
+        if self._job_running("Genre suggestion"):
+            return
+        if not self.files:
+            messagebox.showinfo("Suggest", "Load an input folder first.")
+            return
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            messagebox.showerror("Suggest", "Genre suggestions need numpy (pip install numpy).")
+            return
+        # features are cached, so after new labels only the classification reruns
+        todo = [p for p in self.files if "features" not in (self.library.get(p) or {})]
+        if not todo:
+            self._classify()
+            return
+        self._features_saved_at = time.time()
+        self.status_var.set(f"Extracting features of {len(todo)} file(s)...")
+        scheduler = self.scheduler
+        self.run_in_background(
+            lambda report: features_for_files(todo, report, scheduler=scheduler),
+            lambda results: self._classify(),
+            partial=self._on_features_batch,
+            job="Genre suggestion",
+        )
+
+    def _on_features_batch(self, batch):
+        for path, vec in batch.items():
+            if path in self.library:
+                self.library[path]["features"] = vec
+        if time.time() - self._features_saved_at > 30:
+            self._features_saved_at = time.time()
+            self._save_session()
+
+    def _classify(self):
+        labeled, labels, unlabeled, targets = [], [], [], []
+        for path in self.files:
+            entry = self.library.get(path) or {}
+            vec = entry.get("features")
+            if not vec:
+                continue
+            genre = self.pending_genres.get(path) or entry.get("genre") or ""
+            if genre in self.genres:
+                labeled.append(vec)
+                labels.append(genre)
+            elif not genre:
+                unlabeled.append(vec)
+                targets.append(path)
+        self._save_session()
+        if len(set(labels)) < 2:
+            messagebox.showinfo("Suggest", "Tag tracks in at least two genres first; they are used as examples.")
+            return
+        old = set(self.suggestions)
+        self.suggestions = dict(zip(targets, nearest_centroid(labeled, labels, unlabeled))) if targets else {}
+        for path in old | set(self.suggestions):
+            if self.tree.exists(path):
+                self.tree.set(path, "pending", self._pending_text(path))
+        self._invalidate_sort("pending")
+        self.status_var.set(
+            f"Suggested genres for {len(self.suggestions)} untagged file(s) from {len(labels)} tagged example(s)."
+        )
+
+    def accept_suggestions(self):
+        paths = [p for p in self.selection_paths if p in self.suggestions]
+        if not self.selection_paths:
+            paths = list(self.suggestions)
+            if paths and not messagebox.askyesno("Accept", f"Accept all {len(paths)} suggestion(s)?"):
+                return
+        if not paths:
+            messagebox.showinfo("Accept", "No suggestions for the selected file(s).")
+            return
+        for p in paths:
+            genre = self.suggestions.pop(p)
+            self.history.append((p, self._saved_genre(p), genre))
+            self.pending_genres[p] = genre
+            if self.tree.exists(p):
+                self.tree.set(p, "pending", genre)
+        self._invalidate_sort("pending")
+        self.status_var.set(f"Accepted {len(paths)} suggestion(s) as pending. Save with Ctrl+S.")
+
+    def open_playlists_dialog(self):
+        SmartPlaylistDialog(self)
+
+    def _smart_playlist_path(self, name):
+        return os.path.join(self.output_folder, PLAYLIST_DIR, f"{safe_name(name)}.m3u")
+
+    def set_smart_playlists(self, queries):
+        if self.output_folder:
+            # a removed query's playlist would otherwise stay in the output forever
+            kept = {self._smart_playlist_path(q["name"]) for q in queries}
+            for query in self.smart_playlists:
+                playlist_path = self._smart_playlist_path(query["name"])
+                if playlist_path in kept:
+                    continue
+                self.playlist_digests.pop(playlist_path, None)
+                try:
+                    os.remove(playlist_path)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    print("Playlist remove error:", playlist_path, e)
+        self.smart_playlists = queries
+        if self.playlists_ready:
+            self.playlist_index.set_queries(queries, self.files, self.library)
+        self._save_session()
 
     def run_post_init(self):
         self._seek_bindings()
 
 
-def main():
-    app = TastetifyApp()
+class RulesDialog(tk.Toplevel):
+    """Edit the ordered genre rules, preview the diff, and commit it to pending."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Genre Rules")
+        self.geometry("760x560")
+        self.rules = [dict(r) for r in app.genre_rules]
+        self.diff = []
+
+        rules_frame = ttk.LabelFrame(self, text="Rules (first match wins)", padding=8)
+        rules_frame.pack(fill="both", expand=True, padx=8, pady=(8, 4))
+        self.rules_tree = ttk.Treeview(
+            rules_frame, columns=("field", "pattern", "genre"), show="headings", height=6
+        )
+        for col, width in (("field", 90), ("pattern", 380), ("genre", 140)):
+            self.rules_tree.heading(col, text=col.capitalize())
+            self.rules_tree.column(col, width=width, anchor="w")
+        self.rules_tree.pack(fill="both", expand=True)
+
+        edit = ttk.Frame(rules_frame)
+        edit.pack(fill="x", pady=(6, 0))
+        self.field_var = tk.StringVar(value="path")
+        ttk.Combobox(edit, values=RULE_FIELDS, textvariable=self.field_var, width=8, state="readonly").pack(side="left")
+        self.pattern_var = tk.StringVar()
+        ttk.Entry(edit, textvariable=self.pattern_var).pack(side="left", fill="x", expand=True, padx=4)
+        self.genre_var = tk.StringVar()
+        ttk.Combobox(edit, values=app.genres, textvariable=self.genre_var, width=14).pack(side="left")
+        ttk.Button(edit, text="Add", command=self.add_rule).pack(side="left", padx=(4, 0))
+        ttk.Button(edit, text="Remove", command=self.remove_rule).pack(side="left", padx=(4, 0))
+        ttk.Button(edit, text="Up", width=4, command=lambda: self.move_rule(-1)).pack(side="left", padx=(4, 0))
+        ttk.Button(edit, text="Down", width=5, command=lambda: self.move_rule(1)).pack(side="left", padx=(4, 0))
+
+        actions = ttk.Frame(self, padding=(8, 0))
+        actions.pack(fill="x")
+        ttk.Button(actions, text="Load...", command=self.load_rules).pack(side="left")
+        ttk.Button(actions, text="Save...", command=self.save_rules).pack(side="left", padx=4)
+        ttk.Button(actions, text="Dry Run", command=self.dry_run).pack(side="left", padx=(12, 4))
+        ttk.Button(actions, text="Commit to Pending", command=self.commit).pack(side="left")
+
+        diff_frame = ttk.LabelFrame(self, text="Dry run", padding=8)
+        diff_frame.pack(fill="both", expand=True, padx=8, pady=(4, 8))
+        self.diff_tree = ttk.Treeview(
+            diff_frame, columns=("filename", "old", "new"), show="headings", height=10
+        )
+        for col, text, width in (("filename", "Filename", 380), ("old", "Old", 140), ("new", "New", 140)):
+            self.diff_tree.heading(col, text=text)
+            self.diff_tree.column(col, width=width, anchor="w")
+        self.diff_tree.pack(side="left", fill="both", expand=True)
+        scroll = ttk.Scrollbar(diff_frame, orient="vertical", command=self.diff_tree.yview)
+        scroll.pack(side="right", fill="y")
+        self.diff_tree.configure(yscrollcommand=scroll.set)
+
+        self._refresh_rules()
+
+    def _refresh_rules(self):
+        self.rules_tree.delete(*self.rules_tree.get_children())
+        for i, rule in enumerate(self.rules):
+            self.rules_tree.insert("", "end", iid=str(i), values=(rule["field"], rule["pattern"], rule["genre"]))
+        # a dry run of the old rules must not be committed
+        self.diff = []
+        self.diff_tree.delete(*self.diff_tree.get_children())
+        self.app.genre_rules = [dict(r) for r in self.rules]
+        self.app._save_session()
+
+    def _selected_index(self):
+        sel = self.rules_tree.selection()
+        return int(sel[0]) if sel else None
+
+    def add_rule(self):
+        pattern = self.pattern_var.get().strip()
+        if not pattern:
+            messagebox.showinfo("Rule", "Enter a pattern, e.g. */Jazz/* or *Beatles*.", parent=self)
+            return
+        self.rules.append({"field": self.field_var.get(), "pattern": pattern, "genre": self.genre_var.get().strip()})
+        self.pattern_var.set("")
+        self._refresh_rules()
+
+    def remove_rule(self):
+        idx = self._selected_index()
+        if idx is None:
+            return
+        del self.rules[idx]
+        self._refresh_rules()
+
+    def move_rule(self, delta):
+        idx = self._selected_index()
+        if idx is None:
+            return
+        new = idx + delta
+        if not 0 <= new < len(self.rules):
+            return
+        self.rules[idx], self.rules[new] = self.rules[new], self.rules[idx]
+        self._refresh_rules()
+        self.rules_tree.selection_set(str(new))
+
+    def load_rules(self):
+        path = filedialog.askopenfilename(
+            parent=self, title="Load rule set", filetypes=[("Rule set", "*.json"), ("All files", "*.*")]
+        )
+        if not path:
+            return
+        try:
+            self.rules = load_rules_file(path)
+        except Exception as e:
+            messagebox.showerror("Load rules", str(e), parent=self)
+            return
+        self._refresh_rules()
+
+    def save_rules(self):
+        path = filedialog.asksaveasfilename(
+            parent=self, title="Save rule set", defaultextension=".json", filetypes=[("Rule set", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            save_rules_file(path, self.rules)
+        except Exception as e:
+            messagebox.showerror("Save rules", str(e), parent=self)
+
+    def dry_run(self):
+        app = self.app
+        try:
+            self.diff = evaluate_genre_rules(
+                self.rules, app.files, app.library, app.pending_genres, app.input_folders
+            )
+        except ValueError as e:
+            messagebox.showerror("Rules", str(e), parent=self)
+            return
+        self.diff_tree.delete(*self.diff_tree.get_children())
+        for path, old, new in self.diff:
+            self.diff_tree.insert("", "end", iid=path, values=(os.path.basename(path), old, new))
+        app.status_var.set(f"Rules dry run: {len(self.diff)} file(s) would change.")
+
+    def commit(self):
+        if not self.diff:
+            self.dry_run()
+        if not self.diff:
+            messagebox.showinfo("Rules", "No files would change.", parent=self)
+            return
+        self.app.commit_rule_diff(self.diff)
+        self.diff = []
+        self.diff_tree.delete(*self.diff_tree.get_children())
+
+
+class SmartPlaylistDialog(tk.Toplevel):
+    """Define query-based playlists; they are written by Make Playlists."""
+
+    FIELDS = (
+        ("name", "Name", 140),
+        ("genre", "Genre", 100),
+        ("artist", "Artist", 110),
+        ("album", "Album", 110),
+        ("min_duration", "Min s", 60),
+        ("max_duration", "Max s", 60),
+        ("tagged_within_days", "Tagged ≤ days", 90),
+    )
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Smart Playlists")
+        self.geometry("820x420")
+        self.queries = [dict(q) for q in app.smart_playlists]
+
+        frame = ttk.Frame(self, padding=8)
+        frame.pack(fill="both", expand=True)
+        cols = [f for f, _, _ in self.FIELDS] + ["count"]
+        self.tree = ttk.Treeview(frame, columns=cols, show="headings", height=10)
+        for field, text, width in self.FIELDS:
+            self.tree.heading(field, text=text)
+            self.tree.column(field, width=width, anchor="w")
+        self.tree.heading("count", text="Tracks")
+        self.tree.column("count", width=60, anchor="e")
+        self.tree.pack(fill="both", expand=True)
+
+        edit = ttk.Frame(frame)
+        edit.pack(fill="x", pady=(6, 0))
+        self.vars = {}
+        for field, text, width in self.FIELDS:
+            col = ttk.Frame(edit)
+            col.pack(side="left", padx=(0, 4))
+            ttk.Label(col, text=text).pack(anchor="w")
+            self.vars[field] = tk.StringVar()
+            ttk.Entry(col, textvariable=self.vars[field], width=max(6, width // 9)).pack()
+
+        actions = ttk.Frame(frame)
+        actions.pack(fill="x", pady=(6, 0))
+        ttk.Button(actions, text="Add / Update", command=self.add_query).pack(side="left")
+        ttk.Button(actions, text="Remove", command=self.remove_query).pack(side="left", padx=4)
+        ttk.Label(actions, text="Glob patterns, e.g. *rock*; empty = any.").pack(side="left", padx=12)
+
+        self._refresh()
+
+    def _refresh(self):
+        app = self.app
+        self.tree.delete(*self.tree.get_children())
+        now = time.time()
+        for q in self.queries:
+            query = PlaylistQuery(q)
+            count = sum(1 for p in app.files if query.match(app.library.get(p) or {}, now))
+            values = ["" if q.get(f) is None else q.get(f) for f, _, _ in self.FIELDS]
+            self.tree.insert("", "end", iid=q["name"], values=values + [count])
+
+    def add_query(self):
+        name = self.vars["name"].get().strip()
+        if not name:
+            messagebox.showinfo("Smart playlist", "Enter a playlist name.", parent=self)
+            return
+        query = {"name": name}
+        try:
+            for field, text, _ in self.FIELDS[1:]:
+                raw = self.vars[field].get().strip()
+                if not raw:
+                    continue
+                query[field] = float(raw) if field in ("min_duration", "max_duration", "tagged_within_days") else raw
+        except ValueError:
+            messagebox.showerror("Smart playlist", f"{text} must be a number.", parent=self)
+            return
+        self.queries = [q for q in self.queries if q["name"] != name] + [query]
+        self.app.set_smart_playlists([dict(q) for q in self.queries])
+        self._refresh()
+
+    def remove_query(self):
+        sel = set(self.tree.selection())
+        if not sel:
+            return
+        self.queries = [q for q in self.queries if q["name"] not in sel]
+        self.app.set_smart_playlists([dict(q) for q in self.queries])
+        self._refresh()
+
+
+class DuplicatesDialog(tk.Toplevel):
+    """Show duplicate groups; the first file of each group is the one kept."""
+
+    def __init__(self, app, groups):
+        super().__init__(app)
+        self.app = app
+        self.title("Duplicates")
+        self.geometry("760x460")
+
+        frame = ttk.Frame(self, padding=8)
+        frame.pack(fill="both", expand=True)
+        ttk.Label(
+            frame,
+            text="Same audio, different names/tags. Choose Skip or Hardlink under Export to handle them.",
+        ).pack(anchor="w", pady=(0, 6))
+        tree = ttk.Treeview(frame, columns=("genre", "folder"), show="tree headings")
+        tree.heading("#0", text="File")
+        tree.heading("genre", text="Genre")
+        tree.heading("folder", text="Folder")
+        tree.column("#0", width=320)
+        tree.column("genre", width=100)
+        tree.column("folder", width=300)
+        tree.pack(side="left", fill="both", expand=True)
+        scroll = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+        scroll.pack(side="right", fill="y")
+        tree.configure(yscrollcommand=scroll.set)
+
+        for i, group in enumerate(groups, 1):
+            gid = tree.insert("", "end", text=f"Group {i} ({len(group)} copies)", open=True)
+            for j, path in enumerate(group):
+                entry = app.library.get(path) or {}
+                name = os.path.basename(path) + ("  (keep)" if j == 0 else "")
+                tree.insert(gid, "end", text=name, values=(entry.get("genre", ""), os.path.dirname(path)))
+
+
+class RootsDialog(tk.Toplevel):
+    """Manage the library roots and the I/O concurrency of their devices."""
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.app = app
+        self.title("Library Roots")
+        self.geometry("700x320")
+
+        frame = ttk.Frame(self, padding=8)
+        frame.pack(fill="both", expand=True)
+        self.tree = ttk.Treeview(frame, columns=("root", "lane", "limit"), show="headings", height=8)
+        for col, text, width in (("root", "Root", 440), ("lane", "Device lane", 120), ("limit", "Workers", 80)):
+            self.tree.heading(col, text=text)
+            self.tree.column(col, width=width, anchor="w")
+        self.tree.pack(fill="both", expand=True)
+
+        actions = ttk.Frame(frame)
+        actions.pack(fill="x", pady=(6, 0))
+        ttk.Button(actions, text="Add Root...", command=self.add_root).pack(side="left")
+        ttk.Button(actions, text="Remove", command=self.remove_root).pack(side="left", padx=4)
+        ttk.Label(actions, text="Workers:").pack(side="left", padx=(12, 2))
+        self.limit_var = tk.StringVar(value=str(DEFAULT_LANE_LIMIT))
+        ttk.Spinbox(actions, from_=1, to=32, width=4, textvariable=self.limit_var).pack(side="left")
+        ttk.Button(actions, text="Set", command=self.set_limit).pack(side="left", padx=4)
+        ttk.Label(
+            frame, text="Roots on the same device share one lane; its limit is the lowest one set."
+        ).pack(anchor="w", pady=(6, 0))
+        self._refresh()
+
+    def _refresh(self):
+        sched = self.app.scheduler
+        self.tree.delete(*self.tree.get_children())
+        for root in self.app.input_folders:
+            self.tree.insert("", "end", iid=root, values=(root, sched.lane_label(root), sched.limit_for(root)))
+
+    def add_root(self):
+        folder = filedialog.askdirectory(parent=self, title="Add library root")
+        if not folder:
+            return
+        folder = os.path.abspath(folder)
+        roots = self.app.input_folders
+        if folder in roots:
+            return
+        if any(folder.startswith(r + os.sep) for r in roots):
+            messagebox.showinfo("Roots", "That folder is already inside a library root.", parent=self)
+            return
+        # a new parent root replaces the roots it contains
+        roots = [r for r in roots if not r.startswith(folder + os.sep)] + [folder]
+        self.app.set_roots(roots)
+        self._refresh()
+
+    def remove_root(self):
+        sel = set(self.tree.selection())
+        if not sel:
+            return
+        self.app.set_roots([r for r in self.app.input_folders if r not in sel])
+        self._refresh()
+
+    def set_limit(self):
+        try:
+            limit = max(1, int(self.limit_var.get()))
+        except ValueError:
+            return
+        for root in self.tree.selection():
+            self.app.root_limits[root] = limit
+        self.app.set_roots(self.app.input_folders, rescan=False)
+        self.app._save_session()
+        self._refresh()
+
+
+# ---------------- Headless ----------------
+def run_rules_headless(rules_path, folders, dry_run=False):
+    """Apply a saved rule set to the library roots and write the tags (for nightly ingest)."""
+    folders = [os.path.abspath(f) for f in folders]
+    rules = load_rules_file(rules_path)
+    session = load_session()
+    cache = load_session(LIBRARY_PATH)
+    cached = cache.get("library") or {}
+    files, library = scan_library(folders, cached, IOScheduler(folders, session.get("root_limits")))
+    diff = evaluate_genre_rules(rules, files, library, roots=folders)
+    failed = 0
+    for path, old, new in diff:
+        print(f"{path}: '{old}' -> '{new}'")
+        if dry_run:
+            continue
+        if write_genre(path, new):
+            st = os.stat(path)
+            library[path].update(genre=new, size=st.st_size, mtime=st.st_mtime)
+        else:
+            failed += 1
+    print(f"{len(diff)} file(s) {'would change' if dry_run else 'changed'}, {failed} failed.")
+    session_roots = session.get("input_folders") or []
+    if not dry_run and sorted(os.path.abspath(r) for r in session_roots) == sorted(folders):
+        # keep the GUI's cache warm
+        save_session(
+            {"version": 1, "files": files, "library": library, "exported": cache.get("exported") or {}},
+            LIBRARY_PATH,
+        )
+    return 1 if failed else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tastetify MP3 tagger & player")
+    parser.add_argument("--apply-rules", metavar="RULES_JSON",
+                        help="apply a saved genre rule set to the FOLDERs without the GUI")
+    parser.add_argument("--dry-run", action="store_true", help="with --apply-rules: only print the diff")
+    parser.add_argument("folder", nargs="*", help="library root(s): opened in the GUI, or for --apply-rules")
+    args = parser.parse_args(argv)
+
+    if args.apply_rules:
+        if not args.folder:
+            parser.error("--apply-rules needs at least one FOLDER")
+        return run_rules_headless(args.apply_rules, args.folder, args.dry_run)
+
+    for folder in args.folder:
+        if not os.path.isdir(folder):
+            parser.error(f"not a folder: {folder}")
+    app = TastetifyApp(roots=args.folder or None)
     app.run_post_init()
     app.mainloop()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())